@@ -0,0 +1 @@
+"""Discord agent for Iris"""
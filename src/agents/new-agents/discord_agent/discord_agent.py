@@ -22,20 +22,22 @@ Example Usage:
 """
 
 import asyncio
-import json
+import html
+import logging
 import os
 import re
+import sys
+import time
 import aiohttp
-import aiofiles
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from aiohttp import web
+import orjson
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from uuid import uuid4
-from urllib.parse import urlencode, urlparse, parse_qs
+from urllib.parse import urlencode, urlparse
 import secrets
 import hashlib
-import threading
 import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
 
 from openai import OpenAI
 from uagents import Context, Protocol, Agent
@@ -47,13 +49,34 @@ from uagents_core.contrib.protocols.chat import (
     chat_protocol_spec,
 )
 from dotenv import load_dotenv
-from cryptography.fernet import Fernet
 import requests
 from requests_oauthlib import OAuth2Session
 
+try:
+    from .token_storage import SecureTokenStorage, parse_utc_timestamp, to_epoch_seconds
+except ImportError:
+    # Run as a script: the script's own directory is already on sys.path
+    from token_storage import SecureTokenStorage, parse_utc_timestamp, to_epoch_seconds
+
 # Load environment variables
 load_dotenv()
 
+# Agent diagnostics (user lookups, sends) go through this logger at INFO by
+# default; set DISCORD_AGENT_LOG_LEVEL=DEBUG to trace each lookup step
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(levelname)s: [%(name)s]: %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+_log_level = os.getenv("DISCORD_AGENT_LOG_LEVEL", "INFO").upper()
+try:
+    logger.setLevel(_log_level)
+except ValueError:
+    # A typo in the environment shouldn't stop the agent from importing
+    logger.setLevel(logging.INFO)
+    logger.warning("Unknown DISCORD_AGENT_LOG_LEVEL %r, using INFO", _log_level)
+
 # ASI:One Configuration for LLM processing
 asi_client = OpenAI(
     base_url='https://api.asi1.ai/v1',
@@ -105,93 +128,137 @@ DISCORD_BOT_SCOPES = [
     "guilds:read"           # Read guilds
 ]
 
-# Encryption key for secure token storage (generate once and store securely)
-ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", Fernet.generate_key().decode())
+# Discord rate-limit handling
+DISCORD_MAX_RETRIES = 3              # Attempts per request when Discord answers 429
+DISCORD_RETRY_BASE_DELAY = 0.5       # Seconds; doubled on each retry
+DISCORD_RATE_LIMIT_THRESHOLD = 0     # Wait for the bucket reset once remaining drops to this
+DISCORD_BUCKET_CONCURRENCY = 5       # Concurrent in-flight requests per route
+
+# Seconds before expiry at which the access token is refreshed
+TOKEN_REFRESH_MARGIN = 300
+
+# Concurrent ASI:One completions when parsing several messages at once
+ASI_MAX_CONCURRENCY = 5
+
+# Seconds before the help-text users summary is rebuilt
+USERS_SUMMARY_TTL = 300
+
+# Seconds to reuse a guild member sample; Discord allows roughly one member
+# request per guild every 30 seconds
+GUILD_MEMBERS_CACHE_TTL = 35
+
+# Seconds before users indexed from friends/guild member lists are discarded
+USER_INDEX_TTL = 300
+
+# Adaptive (AIMD) cap on concurrent Discord requests across all routes
+DISCORD_AIMD_INITIAL = 4.0
+DISCORD_AIMD_MIN = 1.0
+DISCORD_AIMD_MAX = 40.0              # Stays under Discord's 50 req/s global limit
+DISCORD_AIMD_INCREASE = 0.5          # Added after each fast, successful request
+DISCORD_AIMD_DECREASE = 0.5          # Multiplier on 429 / 5xx / transport errors
+DISCORD_AIMD_TARGET_LATENCY = 1.0    # Seconds; slower responses don't grow the limit
+
+# Discord HTTP connection pool (shared by every DiscordAPIClient request)
+DISCORD_POOL_LIMIT = 100             # Total open connections
+DISCORD_POOL_LIMIT_PER_HOST = 30     # Open connections to discord.com
+DISCORD_DNS_CACHE_TTL = 600          # Seconds to cache DNS lookups
+DISCORD_KEEPALIVE_TIMEOUT = 75       # Seconds to keep idle connections open
+DISCORD_REQUEST_TIMEOUT = 15         # Total seconds per request
+DISCORD_CONNECT_TIMEOUT = 5          # Seconds to establish a connection
+DISCORD_GUILDS_PAGE_SIZE = 200       # Most guilds Discord returns per /users/@me/guilds page
+
+# Callback pages, encoded once; the error page is filled by bytes.replace
+_INVALID_STATE_HTML = """
+    <html>
+    <head><title>Discord OAuth2 - Error</title></head>
+    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
+        <h1 style="color: #dc3545;">🔒 Security Error: Invalid State</h1>
+        <p>The authorization request may have been tampered with.</p>
+        <p>Please close this window and try again.</p>
+    </body>
+    </html>
+""".encode('utf-8')
+
+_SUCCESS_HTML = """
+    <html>
+    <head><title>Discord OAuth2 - Success</title></head>
+    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
+        <h1 style="color: #28a745;">✅ Discord Authorization Successful!</h1>
+        <p>You have successfully connected your Discord account!</p>
+        <p>You can close this window and return to the chat.</p>
+        <script>setTimeout(() => window.close(), 3000);</script>
+    </body>
+    </html>
+""".encode('utf-8')
 
-class OAuthCallbackHandler(BaseHTTPRequestHandler):
-    """Handles OAuth2 callback from Discord"""
+_ERROR_HTML_TMPL = """
+    <html>
+    <head><title>Discord OAuth2 - Error</title></head>
+    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
+        <h1 style="color: #dc3545;">❌ Discord Authorization Failed</h1>
+        <p><strong>Error:</strong> __ERROR__</p>
+        <p><strong>Description:</strong> __DESCRIPTION__</p>
+        <p>Please close this window and try again.</p>
+    </body>
+    </html>
+""".encode('utf-8')
+
+def render_oauth_error_page(template: bytes, error: str, error_description: str) -> bytes:
+    """Fill an OAuth error page template with HTML-escaped error details"""
+    return (template
+            .replace(b'__ERROR__', html.escape(error).encode('utf-8'))
+            .replace(b'__DESCRIPTION__', html.escape(error_description).encode('utf-8')))
+
+def build_oauth_callback_app(expected_state: str, result: asyncio.Future) -> web.Application:
+    """Build the aiohttp app that handles the OAuth2 callback from Discord.
+    
+    The first callback resolves result with (authorization_code, authorization_error).
+    """
     
-    def do_GET(self):
+    def resolve(code, error):
+        if not result.done():
+            result.set_result((code, error))
+    
+    async def handle_callback(request: web.Request) -> web.Response:
         """Handle GET request from Discord OAuth callback"""
-        parsed_path = urlparse(self.path)
-        query_params = parse_qs(parsed_path.query)
+        query_params = request.query
         
         # Validate state parameter for CSRF protection
-        received_state = query_params.get('state', [None])[0]
-        expected_state = getattr(self.server, 'expected_state', None)
-        
-        if received_state != expected_state:
-            self.server.authorization_error = "invalid_state"
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write("""
-                <html>
-                <head><title>Discord OAuth2 - Error</title></head>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
-                    <h1 style="color: #dc3545;">🔒 Security Error: Invalid State</h1>
-                    <p>The authorization request may have been tampered with.</p>
-                    <p>Please close this window and try again.</p>
-                </body>
-                </html>
-            """.encode('utf-8'))
-            return
+        if query_params.get('state') != expected_state:
+            resolve(None, "invalid_state")
+            return web.Response(status=400, body=_INVALID_STATE_HTML, content_type='text/html', charset='utf-8')
         
         if 'code' in query_params:
             # Success - authorization code received
-            self.server.authorization_code = query_params['code'][0]
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write("""
-                <html>
-                <head><title>Discord OAuth2 - Success</title></head>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
-                    <h1 style="color: #28a745;">✅ Discord Authorization Successful!</h1>
-                    <p>You have successfully connected your Discord account!</p>
-                    <p>You can close this window and return to the chat.</p>
-                    <script>setTimeout(() => window.close(), 3000);</script>
-                </body>
-                </html>
-            """.encode('utf-8'))
-        elif 'error' in query_params:
+            resolve(query_params['code'], None)
+            return web.Response(body=_SUCCESS_HTML, content_type='text/html', charset='utf-8')
+        
+        if 'error' in query_params:
             # Error in authorization
-            error = query_params.get('error', ['unknown'])[0]
-            error_description = query_params.get('error_description', [''])[0]
-            self.server.authorization_error = error
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(f"""
-                <html>
-                <head><title>Discord OAuth2 - Error</title></head>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
-                    <h1 style="color: #dc3545;">❌ Discord Authorization Failed</h1>
-                    <p><strong>Error:</strong> {error}</p>
-                    <p><strong>Description:</strong> {error_description}</p>
-                    <p>Please close this window and try again.</p>
-                </body>
-                </html>
-            """.encode('utf-8'))
+            error = query_params.get('error', 'unknown')
+            error_description = query_params.get('error_description', '')
+            resolve(None, error)
+            body = render_oauth_error_page(_ERROR_HTML_TMPL, error, error_description)
+            return web.Response(status=400, body=body, content_type='text/html', charset='utf-8')
         
-        # Stop the server after handling the request
-        threading.Thread(target=self.server.shutdown).start()
+        resolve(None, None)
+        return web.Response(status=400)
     
-    def log_message(self, format, *args):
-        """Suppress server log messages"""
-        pass
+    app = web.Application()
+    app.router.add_get(urlparse(DISCORD_REDIRECT_URI).path or '/callback', handle_callback)
+    return app
 
 class DiscordAuthManager:
     """Handles Discord OAuth2 authentication and secure token management"""
     
     def __init__(self):
-        self.token_file = "discord_tokens.enc"
-        self.cipher = Fernet(ENCRYPTION_KEY.encode()) if ENCRYPTION_KEY else None
+        self.storage = SecureTokenStorage()
         self.access_token = None
         self.refresh_token = None
-        self.token_expires_at = None
-        self._callback_server = None
-        self._server_thread = None
+        self.token_expires_at: Optional[float] = None  # Epoch seconds
+        self._callback_runner: Optional[web.AppRunner] = None
+        self._callback_result: Optional[asyncio.Future] = None
+        self._browser_task: Optional[asyncio.Task] = None
         
     async def start_oauth_flow(self) -> str:
         """Start complete OAuth flow with local callback server"""
@@ -203,25 +270,22 @@ class DiscordAuthManager:
         callback_port = parsed_uri.port or 8080
         
         try:
-            # Start local callback server
-            self._callback_server = HTTPServer(('localhost', callback_port), OAuthCallbackHandler)
-            self._callback_server.authorization_code = None
-            self._callback_server.authorization_error = None
-            
             # Generate state for CSRF protection
             state = secrets.token_urlsafe(32)
-            self._callback_server.expected_state = state
             
-            # Start server in background thread
-            self._server_thread = threading.Thread(target=self._callback_server.serve_forever)
-            self._server_thread.daemon = True
-            self._server_thread.start()
+            # Start local callback server on the agent's event loop
+            self._callback_result = asyncio.get_running_loop().create_future()
+            self._callback_runner = web.AppRunner(build_oauth_callback_app(state, self._callback_result))
+            await self._callback_runner.setup()
+            await web.TCPSite(self._callback_runner, 'localhost', callback_port).start()
             
             # Generate and return OAuth URL
             auth_url, _ = await self.get_auth_url(state)
             
-            # Open browser automatically
-            webbrowser.open(auth_url)
+            # Open browser automatically; launching it can block for a while,
+            # so do it in a worker thread without waiting. If it fails, the
+            # user can still open the URL below by hand.
+            self._browser_task = asyncio.create_task(asyncio.to_thread(webbrowser.open, auth_url))
             
             return f"""🔗 **Discord Authentication Started**
 
@@ -234,55 +298,46 @@ A browser window should have opened automatically. If not, please visit:
 After authorizing, you'll be redirected back automatically."""
             
         except Exception as e:
-            if self._callback_server:
-                self._cleanup_server()
+            await self._cleanup_server()
             raise Exception(f"Failed to start OAuth flow: {e}")
     
     async def wait_for_oauth_completion(self, timeout_seconds: int = 120) -> str:
         """Wait for OAuth completion and process the result"""
-        if not self._callback_server:
+        if not self._callback_result:
             return "❌ No OAuth flow in progress"
         
-        # Wait for callback with timeout
-        elapsed = 0
-        while (self._callback_server.authorization_code is None and 
-               self._callback_server.authorization_error is None and 
-               elapsed < timeout_seconds):
-            await asyncio.sleep(1)
-            elapsed += 1
-        
         try:
-            if elapsed >= timeout_seconds:
+            # Wait for callback with timeout
+            try:
+                code, error = await asyncio.wait_for(
+                    asyncio.shield(self._callback_result), timeout=timeout_seconds
+                )
+            except asyncio.TimeoutError:
                 return "⏰ Authorization timed out after 2 minutes. Please try again."
             
-            if self._callback_server.authorization_error:
-                error = self._callback_server.authorization_error
+            if error:
                 return f"❌ Authorization failed: {error}. Please try again."
             
-            if not self._callback_server.authorization_code:
+            if not code:
                 return "❌ No authorization code received. Please try again."
             
             # Exchange code for token
-            code = self._callback_server.authorization_code
             token_data = await self.exchange_code_for_token(code)
             
             return f"✅ **Discord Connected Successfully!**\n\nYou can now use Discord commands like:\n• 'Send Ben: Running late!'\n• 'Show messages from Alice'\n• 'What can you do?'"
             
         finally:
-            self._cleanup_server()
+            await self._cleanup_server()
     
-    def _cleanup_server(self):
+    async def _cleanup_server(self):
         """Clean up the OAuth callback server"""
-        if self._callback_server:
+        if self._callback_runner:
             try:
-                self._callback_server.shutdown()
-                self._callback_server.server_close()
+                await self._callback_runner.cleanup()
             except:
                 pass
-            self._callback_server = None
-        
-        if self._server_thread:
-            self._server_thread = None
+            self._callback_runner = None
+        self._callback_result = None
         
     async def get_auth_url(self, state: str = None) -> Tuple[str, str]:
         """Generate Discord OAuth2 authorization URL"""
@@ -326,48 +381,38 @@ After authorizing, you'll be redirected back automatically."""
         else:
             raise Exception(f"Token exchange failed: {response.text}")
     
-    async def save_tokens(self, token_data: Dict):
-        """Securely save tokens to encrypted file"""
+    async def save_tokens(self, token_data: Dict) -> Optional[str]:
+        """Securely save tokens to encrypted file, returning the new access token, or None if nothing was written"""
         self.access_token = token_data['access_token']
         self.refresh_token = token_data.get('refresh_token')
-        self.token_expires_at = datetime.now() + timedelta(seconds=token_data.get('expires_in', 3600))
         
-        if self.cipher:
-            # Enhanced token data with timestamps for better expiry tracking
-            enhanced_token_data = {
-                **token_data,
-                'saved_at': datetime.now().isoformat(),
-                'expires_at': self.token_expires_at.isoformat()
-            }
-            
-            encrypted_data = self.cipher.encrypt(json.dumps(enhanced_token_data).encode())
-            async with aiofiles.open(self.token_file, 'wb') as f:
-                await f.write(encrypted_data)
+        stored_data = await self.storage.save_tokens(token_data)
+        if stored_data:
+            self.token_expires_at = stored_data['expires_at']
+            return self.access_token
+        
+        # No encryption key: keep the tokens in memory only
+        self.token_expires_at = time.time() + token_data.get('expires_in', 3600)
+        return None
     
     async def load_tokens(self) -> bool:
         """Load and decrypt saved tokens"""
         try:
-            if not os.path.exists(self.token_file) or not self.cipher:
+            token_data = await self.storage.load_tokens()
+            if not token_data:
                 return False
-                
-            async with aiofiles.open(self.token_file, 'rb') as f:
-                encrypted_data = await f.read()
-                
-            decrypted_data = self.cipher.decrypt(encrypted_data)
-            token_data = json.loads(decrypted_data.decode())
             
             self.access_token = token_data['access_token']
             self.refresh_token = token_data.get('refresh_token')
             
             # Use stored expiry time if available, otherwise calculate from expires_in
             if 'expires_at' in token_data:
-                self.token_expires_at = datetime.fromisoformat(token_data['expires_at'].replace('Z', '+00:00'))
+                self.token_expires_at = to_epoch_seconds(token_data['expires_at'])
             elif 'expires_in' in token_data and 'saved_at' in token_data:
-                saved_at = datetime.fromisoformat(token_data['saved_at'].replace('Z', '+00:00'))
-                self.token_expires_at = saved_at + timedelta(seconds=token_data['expires_in'])
+                self.token_expires_at = to_epoch_seconds(token_data['saved_at']) + token_data['expires_in']
             else:
                 # Fallback: assume token expires in 1 hour
-                self.token_expires_at = datetime.now() + timedelta(hours=1)
+                self.token_expires_at = time.time() + 3600
             
             return True
         except Exception as e:
@@ -407,7 +452,7 @@ After authorizing, you'll be redirected back automatically."""
         
         # Check if token is expired and refresh if needed
         if (self.token_expires_at and 
-            datetime.now() >= self.token_expires_at - timedelta(minutes=5)):
+            time.time() >= self.token_expires_at - TOKEN_REFRESH_MARGIN):
             if not await self.refresh_access_token():
                 return None
                 
@@ -432,95 +477,293 @@ After authorizing, you'll be redirected back automatically."""
             return False
 
 
+def _display_name(user: Dict, default: str = '') -> str:
+    """Format a Discord user as username#discriminator (or just username for migrated accounts)"""
+    discriminator = user.get('discriminator') or '0'
+    username = user.get('username', default)
+    return f"{username}#{discriminator}" if discriminator != '0' else username
+
+
+def _truncate(error: Exception, limit: int) -> str:
+    """Short description of an exception, sliced from its message when possible"""
+    message = error.args[0] if error.args and isinstance(error.args[0], str) else str(error)
+    return message[:limit]
+
+
+def _orjson_dumps(obj) -> str:
+    """JSON serializer for aiohttp sessions backed by orjson"""
+    return orjson.dumps(obj).decode()
+
+def _make_resolver():
+    """c-ares DNS resolver from aiohttp[speedups], or the threaded stdlib one without aiodns"""
+    try:
+        return aiohttp.AsyncResolver()
+    except RuntimeError:
+        return aiohttp.ThreadedResolver()
+
+
+class RateLimitBucket:
+    """Tracks Discord rate-limit state for a single API route"""
+    
+    def __init__(self):
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0  # time.monotonic() deadline when the bucket refills
+        self.semaphore = asyncio.Semaphore(DISCORD_BUCKET_CONCURRENCY)
+    
+    def delay(self) -> float:
+        """Seconds to wait before the next request can be issued safely"""
+        if self.remaining is None or self.remaining > DISCORD_RATE_LIMIT_THRESHOLD:
+            return 0.0
+        return max(0.0, self.reset_at - time.monotonic())
+    
+    def update(self, headers) -> None:
+        """Update bucket state from Discord's X-RateLimit-* response headers"""
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset_after = headers.get('X-RateLimit-Reset-After')
+        if remaining is not None:
+            self.remaining = int(remaining)
+        if reset_after is not None:
+            self.reset_at = time.monotonic() + float(reset_after)
+
+
+class AIMDLimiter:
+    """Adaptive concurrency limiter using additive-increase / multiplicative-decrease.
+    
+    The limit grows by DISCORD_AIMD_INCREASE after each fast, successful request
+    and is multiplied by DISCORD_AIMD_DECREASE when Discord throttles (429) or
+    fails (5xx / transport error).
+    """
+    
+    def __init__(self):
+        self.limit = DISCORD_AIMD_INITIAL
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+    
+    async def acquire(self) -> None:
+        """Wait until a request slot is free under the current limit"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+    
+    async def release(self, latency: float, throttled: bool) -> None:
+        """Free a request slot and adjust the limit from the observed outcome"""
+        async with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self.limit = max(DISCORD_AIMD_MIN, self.limit * DISCORD_AIMD_DECREASE)
+            elif latency <= DISCORD_AIMD_TARGET_LATENCY:
+                self.limit = min(DISCORD_AIMD_MAX, self.limit + DISCORD_AIMD_INCREASE)
+            self._condition.notify_all()
+
+
 class DiscordAPIClient:
     """Discord REST API client for messaging operations"""
     
     def __init__(self, auth_manager: DiscordAuthManager):
         self.auth_manager = auth_manager
         self.user_cache = {}  # Cache Discord user info
+        self._dm_channels: Dict[str, str] = {}  # Cache DM channel IDs by recipient user ID
+        self._buckets: Dict[str, RateLimitBucket] = {}  # Rate-limit state per route
+        self._headers_cache: Optional[Tuple[str, Dict[str, str]]] = None  # (token, headers)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._admission = AIMDLimiter()  # Adaptive cap on concurrent Discord requests
+        self._users_summary: Optional[Tuple[float, str]] = None  # (monotonic time, summary)
+        self._user_index: Dict[str, Dict] = {}  # Lowercase username / name#discriminator -> user
+        self._user_index_built_at = 0.0
+        self._member_cache: Dict[Tuple[str, int], Tuple[float, List[Dict]]] = {}  # (guild, limit) -> (time, members)
+        self._users_summary_task: Optional[asyncio.Task] = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Get the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                resolver=_make_resolver(),
+                limit=DISCORD_POOL_LIMIT,
+                limit_per_host=DISCORD_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=DISCORD_DNS_CACHE_TTL,
+                enable_cleanup_closed=True,
+                keepalive_timeout=DISCORD_KEEPALIVE_TIMEOUT,
+                happy_eyeballs_delay=0.25
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=DISCORD_REQUEST_TIMEOUT, connect=DISCORD_CONNECT_TIMEOUT),
+                json_serialize=_orjson_dumps
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared HTTP session"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def __aenter__(self) -> "DiscordAPIClient":
+        await self._get_session()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
         
     async def get_headers(self) -> Dict[str, str]:
-        """Get authenticated headers for Discord API requests"""
+        """Get authenticated headers for Discord API requests.
+        
+        The dict is cached per access token and shared between requests, so
+        callers must not mutate it. A refreshed token rebuilds it.
+        """
         token = await self.auth_manager.get_valid_token()
         if not token:
             raise Exception("No valid Discord token available")
+        
+        if self._headers_cache and self._headers_cache[0] == token:
+            return self._headers_cache[1]
             
-        return {
+        headers = {
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
             'User-Agent': 'VocalAgent Discord Bot'
         }
+        self._headers_cache = (token, headers)
+        return headers
+    
+    async def _request(self, method: str, path: str, **kwargs) -> Tuple[int, object]:
+        """Issue a Discord API request, honouring rate-limit headers.
+        
+        Returns the HTTP status and the decoded JSON body on success, or the
+        raw response text otherwise. HTTP 429 responses are retried after
+        Retry-After with exponential backoff, up to DISCORD_MAX_RETRIES tries.
+        """
+        bucket = self._buckets.get(path)
+        if bucket is None:
+            bucket = self._buckets[path] = RateLimitBucket()
+        
+        async with bucket.semaphore:
+            for attempt in range(DISCORD_MAX_RETRIES):
+                delay = bucket.delay()
+                if delay:
+                    await asyncio.sleep(delay)
+                
+                headers = await self.get_headers()
+                session = await self._get_session()
+                
+                await self._admission.acquire()
+                started = time.monotonic()
+                throttled = True  # Treat transport errors as a congestion signal
+                try:
+                    async with session.request(
+                        method, f"{DISCORD_API_BASE}{path}", headers=headers, **kwargs
+                    ) as resp:
+                        bucket.update(resp.headers)
+                        status = resp.status
+                        throttled = status == 429 or status >= 500
+                        if status == 429:
+                            retry_after = float(resp.headers.get('Retry-After', 1))
+                            body = await resp.text()
+                        elif 200 <= status < 300 and status != 204:
+                            body = await resp.json(loads=orjson.loads)
+                        else:
+                            body = await resp.text()
+                finally:
+                    await self._admission.release(time.monotonic() - started, throttled)
+                
+                if status != 429 or attempt == DISCORD_MAX_RETRIES - 1:
+                    return status, body
+                
+                await asyncio.sleep(max(retry_after, DISCORD_RETRY_BASE_DELAY * 2 ** attempt))
     
     async def get_current_user(self) -> Dict:
         """Get current authenticated user info"""
-        headers = await self.get_headers()
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{DISCORD_API_BASE}/users/@me", headers=headers) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise Exception(f"Failed to get user info: {await resp.text()}")
+        status, body = await self._request('GET', '/users/@me')
+        if status == 200:
+            return body
+        else:
+            raise Exception(f"Failed to get user info: {body}")
     
     async def get_user_relationships(self) -> List[Dict]:
         """Get user's friends list (DEPRECATED: Discord restricts this API)"""
         try:
-            headers = await self.get_headers()
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{DISCORD_API_BASE}/users/@me/relationships",
-                    headers=headers
-                ) as resp:
-                    if resp.status == 200:
-                        return await resp.json()
-                    elif resp.status == 401:
-                        print("⚠️  Friends list access denied - Discord has restricted this API for user tokens")
-                        return []
-                    else:
-                        print(f"Failed to get relationships: {resp.status}")
-                        return []
+            status, body = await self._request('GET', '/users/@me/relationships')
+            if status == 200:
+                self._index_users(rel.get('user') for rel in body)
+                return body
+            elif status == 401:
+                logger.info("⚠️  Friends list access denied - Discord has restricted this API for user tokens")
+                return []
+            else:
+                logger.warning("Failed to get relationships: %s", status)
+                return []
         except Exception as e:
-            print(f"Error getting relationships: {e}")
+            logger.warning("Error getting relationships: %s", e)
             return []
     
     async def get_guild_members_sample(self, guild_id: str, limit: int = 50) -> List[Dict]:
         """Get a sample of guild members (for user discovery)"""
+        cached = self._member_cache.get((guild_id, limit))
+        if cached and time.monotonic() - cached[0] < GUILD_MEMBERS_CACHE_TTL:
+            return cached[1]
+        
         try:
-            headers = await self.get_headers()
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{DISCORD_API_BASE}/guilds/{guild_id}/members",
-                    headers=headers,
-                    params={'limit': limit}
-                ) as resp:
-                    if resp.status == 200:
-                        return await resp.json()
-                    elif resp.status == 403:
-                        print(f"⚠️  No permission to view members in guild {guild_id}")
-                        return []
-                    else:
-                        print(f"Failed to get guild members: {resp.status}")
-                        return []
+            status, body = await self._request(
+                'GET',
+                f"/guilds/{guild_id}/members",
+                params={'limit': limit}
+            )
+            if status == 200:
+                self._member_cache[(guild_id, limit)] = (time.monotonic(), body)
+                self._index_users(member.get('user') for member in body)
+                return body
+            elif status == 403:
+                logger.info("⚠️  No permission to view members in guild %s", guild_id)
+                return []
+            else:
+                logger.warning("Failed to get guild members: %s", status)
+                return []
         except Exception as e:
-            print(f"Error getting guild members: {e}")
+            logger.warning("Error getting guild members: %s", e)
             return []
     
+    async def get_guild_members_sample_batch(self, guild_ids: List[str], per_guild: int = 5) -> Dict[str, object]:
+        """Sample members from several guilds concurrently.
+        
+        Returns a dict mapping each guild ID to its member list, or to the
+        exception raised while fetching it. Concurrency is bounded by the
+        client's adaptive limiter and per-route rate-limit buckets.
+        """
+        results = await asyncio.gather(
+            *[self.get_guild_members_sample(guild_id, per_guild) for guild_id in guild_ids],
+            return_exceptions=True
+        )
+        return dict(zip(guild_ids, results))
+    
+    def _index_users(self, users) -> None:
+        """Index fetched users by lowercase username and username#discriminator"""
+        now = time.monotonic()
+        if now - self._user_index_built_at >= USER_INDEX_TTL:
+            self._user_index.clear()
+            self._user_index_built_at = now
+        
+        for user in users:
+            if not user or not user.get('username'):
+                continue
+            # Keep the first user seen for a bare username, matching the scan order
+            self._user_index.setdefault(user['username'].lower(), user)
+            self._user_index.setdefault(_display_name(user).lower(), user)
+    
+    def _lookup_indexed_user(self, key: str) -> Optional[Dict]:
+        """Look up an indexed user, ignoring the index once it has expired"""
+        if time.monotonic() - self._user_index_built_at >= USER_INDEX_TTL:
+            return None
+        return self._user_index.get(key)
+    
     def parse_username(self, username_input: str) -> Dict[str, str]:
         """Parse username input to extract components"""
-        # Handle format: username#discriminator
-        if '#' in username_input:
-            parts = username_input.split('#')
-            return {
-                'username': parts[0].strip(),
-                'discriminator': parts[1].strip() if len(parts) > 1 else None,
-                'full_name': username_input.strip()
-            }
-        else:
-            return {
-                'username': username_input.strip(),
-                'discriminator': None,
-                'full_name': username_input.strip()
-            }
+        # Handle format: username#discriminator (a single partition, no regex needed)
+        username, sep, discriminator = username_input.partition('#')
+        return {
+            'username': username.strip(),
+            'discriminator': discriminator.partition('#')[0].strip() if sep else None,
+            'full_name': username_input.strip()
+        }
     
     async def find_user_by_username(self, username_input: str) -> Optional[Dict]:
         """Find Discord user by username with guild-focused search strategy"""
@@ -530,10 +773,17 @@ class DiscordAPIClient:
         
         # Check cache first
         if cache_key in self.user_cache:
-            print(f"✅ Found {parsed['full_name']} in cache")
+            logger.debug("✅ Found %s in cache", parsed['full_name'])
             return self.user_cache[cache_key]
         
-        print(f"🔍 Searching for user: {parsed['full_name']}")
+        # Then the index of users seen in recent friends/guild member fetches
+        user = self._lookup_indexed_user(cache_key)
+        if user:
+            logger.debug("✅ Found %s in recent member lists", parsed['full_name'])
+            self.user_cache[cache_key] = user
+            return user
+        
+        logger.debug("🔍 Searching for user: %s", parsed['full_name'])
         
         # Strategy 1: Try friends list (likely to fail due to Discord restrictions)
         friends_found = False
@@ -552,18 +802,18 @@ class DiscordAPIClient:
                     if parsed['discriminator']:
                         if (user_username.lower() == parsed['username'].lower() and 
                             user_discriminator == parsed['discriminator']):
-                            print(f"✅ Found friend: {user_username}#{user_discriminator}")
+                            logger.debug("✅ Found friend: %s#%s", user_username, user_discriminator)
                             self.user_cache[cache_key] = user
                             return user
                     else:
                         # Match by username only
                         if user_username.lower() == parsed['username'].lower():
-                            print(f"✅ Found friend: {user_username}#{user_discriminator}")
+                            logger.debug("✅ Found friend: %s#%s", user_username, user_discriminator)
                             self.user_cache[cache_key] = user
                             return user
                 friends_found = True
         except Exception as e:
-            print(f"⚠️  Friends search unavailable: {e}")
+            logger.info("⚠️  Friends search unavailable: %s", e)
         
         # Strategy 2: Search through mutual guilds (primary strategy for user tokens)
         guilds_searched = 0
@@ -571,7 +821,7 @@ class DiscordAPIClient:
         
         try:
             guilds = await self.get_user_guilds()
-            print(f"🏰 Searching {len(guilds)} mutual guilds for '{parsed['username']}'...")
+            logger.debug("🏰 Searching %d mutual guilds for '%s'...", len(guilds), parsed['username'])
             
             for guild in guilds[:10]:  # Search more guilds but with reasonable limit
                 guild_id = guild['id']
@@ -581,7 +831,7 @@ class DiscordAPIClient:
                     members = await self.get_guild_members_sample(guild_id, 100)
                     if members:
                         guilds_searched += 1
-                        print(f"   📋 Searching {len(members)} members in {guild_name}")
+                        logger.debug("   📋 Searching %d members in %s", len(members), guild_name)
                         
                         for member in members:
                             user = member.get('user', {})
@@ -595,7 +845,7 @@ class DiscordAPIClient:
                             if parsed['discriminator']:
                                 if (user_username.lower() == parsed['username'].lower() and 
                                     user_discriminator == parsed['discriminator']):
-                                    print(f"✅ Found exact match in {guild_name}: {user_username}#{user_discriminator}")
+                                    logger.debug("✅ Found exact match in %s: %s#%s", guild_name, user_username, user_discriminator)
                                     self.user_cache[cache_key] = user
                                     return user
                             else:
@@ -610,163 +860,182 @@ class DiscordAPIClient:
                                         })
                         
                 except Exception as e:
-                    print(f"   ⚠️  Could not search guild {guild_name}: {e}")
+                    logger.info("   ⚠️  Could not search guild %s: %s", guild_name, e)
                     continue
                     
         except Exception as e:
-            print(f"⚠️  Guild search failed: {e}")
+            logger.warning("⚠️  Guild search failed: %s", e)
         
         # Handle multiple matches - return the first one but inform about others
         if users_found:
             if len(users_found) == 1:
                 match = users_found[0]
-                print(f"✅ Found in {match['guild']}: {match['display']}")
+                logger.debug("✅ Found in %s: %s", match['guild'], match['display'])
                 self.user_cache[cache_key] = match['user']
                 return match['user']
             else:
                 # Multiple matches found - return first but cache info about others
                 match = users_found[0]
-                print(f"✅ Found {len(users_found)} users named '{parsed['username']}':")
+                logger.debug("✅ Found %d users named '%s':", len(users_found), parsed['username'])
                 for i, m in enumerate(users_found[:3]):
-                    print(f"   {i+1}. {m['display']} (in {m['guild']})")
-                print(f"   Using first match: {match['display']}")
+                    logger.debug("   %d. %s (in %s)", i + 1, m['display'], m['guild'])
+                logger.debug("   Using first match: %s", match['display'])
                 self.user_cache[cache_key] = match['user']
                 return match['user']
         
         # No matches found
         if guilds_searched == 0:
-            print(f"❌ Could not search any guilds for '{parsed['full_name']}' (permission denied)")
+            logger.info("❌ Could not search any guilds for '%s' (permission denied)", parsed['full_name'])
         else:
-            print(f"❌ User '{parsed['full_name']}' not found in {guilds_searched} accessible guilds")
+            logger.info("❌ User '%s' not found in %d accessible guilds", parsed['full_name'], guilds_searched)
             
         return None
     
     async def find_user_by_id(self, user_id: str) -> Optional[Dict]:
         """Find Discord user by user ID (more reliable than username)"""
         try:
-            headers = await self.get_headers()
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{DISCORD_API_BASE}/users/{user_id}",
-                    headers=headers
-                ) as resp:
-                    if resp.status == 200:
-                        user = await resp.json()
-                        # Cache the user
-                        self.user_cache[user.get('username', user_id)] = user
-                        return user
+            status, body = await self._request('GET', f"/users/{user_id}")
+            if status == 200:
+                user = body
+                # Cache the user
+                self.user_cache[user.get('username', user_id)] = user
+                return user
         except Exception as e:
-            print(f"Error getting user by ID {user_id}: {e}")
+            logger.warning("Error getting user by ID %s: %s", user_id, e)
         
         return None
     
     async def get_dm_channel_with_user(self, user_id: str) -> Dict:
         """Create or get DM channel with a user"""
-        headers = await self.get_headers()
         data = {'recipient_id': user_id}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{DISCORD_API_BASE}/users/@me/channels", 
-                headers=headers, 
-                json=data
-            ) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise Exception(f"Failed to create DM channel: {await resp.text()}")
+        status, body = await self._request('POST', '/users/@me/channels', json=data)
+        if status == 200:
+            return body
+        else:
+            raise Exception(f"Failed to create DM channel: {body}")
     
     async def send_message(self, channel_id: str, content: str) -> Dict:
         """Send a message to a Discord channel"""
-        headers = await self.get_headers()
-        data = {'content': content}
+        data = orjson.dumps({'content': content})
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{DISCORD_API_BASE}/channels/{channel_id}/messages",
-                headers=headers,
-                json=data
-            ) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise Exception(f"Failed to send message: {await resp.text()}")
+        status, body = await self._request('POST', f"/channels/{channel_id}/messages", data=data)
+        if status == 200:
+            return body
+        else:
+            raise Exception(f"Failed to send message ({status}): {body}")
     
     async def get_messages(self, channel_id: str, limit: int = 50) -> List[Dict]:
         """Retrieve messages from a Discord channel"""
-        headers = await self.get_headers()
         params = {'limit': min(limit, 100)}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{DISCORD_API_BASE}/channels/{channel_id}/messages",
-                headers=headers,
-                params=params
-            ) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise Exception(f"Failed to get messages: {await resp.text()}")
+        status, body = await self._request('GET', f"/channels/{channel_id}/messages", params=params)
+        if status == 200:
+            return body
+        else:
+            raise Exception(f"Failed to get messages ({status}): {body}")
+    
+    async def get_dm_channel_id(self, user_id: str) -> str:
+        """Get DM channel ID for a user, reusing the cached ID when available"""
+        channel_id = self._dm_channels.get(user_id)
+        if not channel_id:
+            channel_id = (await self.get_dm_channel_with_user(user_id))['id']
+            self._dm_channels[user_id] = channel_id
+        return channel_id
     
     async def send_dm_to_user(self, user_id: str, message: str) -> Dict:
         """Send a direct message to a user"""
-        dm_channel = await self.get_dm_channel_with_user(user_id)
-        return await self.send_message(dm_channel['id'], message)
+        channel_id = await self.get_dm_channel_id(user_id)
+        try:
+            return await self.send_message(channel_id, message)
+        except Exception as e:
+            # Drop a stale channel so the next send re-resolves it
+            if "404" in str(e):
+                self._dm_channels.pop(user_id, None)
+            raise
     
     async def get_dm_history_with_user(self, user_id: str, limit: int = 10) -> List[Dict]:
         """Get DM history with a specific user"""
-        dm_channel = await self.get_dm_channel_with_user(user_id)
-        return await self.get_messages(dm_channel['id'], limit)
+        channel_id = await self.get_dm_channel_id(user_id)
+        try:
+            return await self.get_messages(channel_id, limit)
+        except Exception as e:
+            if "404" in str(e):
+                self._dm_channels.pop(user_id, None)
+            raise
     
     async def get_current_authorization_info(self) -> Dict:
         """Get current authorization info using Discord's /oauth2/@me endpoint"""
-        headers = await self.get_headers()
+        status, body = await self._request('GET', '/oauth2/@me')
+        if status == 200:
+            return body
+        else:
+            raise Exception(f"Failed to get authorization info: {body}")
+    
+    async def iter_user_guilds(self, page_size: int = DISCORD_GUILDS_PAGE_SIZE) -> AsyncIterator[Dict]:
+        """Yield the user's guilds page by page (requires 'guilds' scope)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{DISCORD_API_BASE}/oauth2/@me", headers=headers) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise Exception(f"Failed to get authorization info: {await resp.text()}")
+        Pages are fetched lazily with Discord's after= cursor, so callers that
+        only need the first few guilds can stop iterating early.
+        """
+        params = {'limit': page_size}
+        while True:
+            status, body = await self._request('GET', '/users/@me/guilds', params=params)
+            if status != 200:
+                raise Exception(f"Failed to get user guilds: {body}")
+            for guild in body:
+                yield guild
+            if len(body) < page_size:
+                return
+            params = {'limit': page_size, 'after': body[-1]['id']}
     
     async def get_user_guilds(self) -> List[Dict]:
-        """Get user's guilds (requires 'guilds' scope)"""
-        headers = await self.get_headers()
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{DISCORD_API_BASE}/users/@me/guilds", headers=headers) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise Exception(f"Failed to get user guilds: {await resp.text()}")
+        """Get all of the user's guilds (requires 'guilds' scope)"""
+        return [guild async for guild in self.iter_user_guilds()]
     
     async def get_user_connections(self) -> List[Dict]:
         """Get user's connected accounts (requires 'connections' scope)"""
-        headers = await self.get_headers()
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{DISCORD_API_BASE}/users/@me/connections", headers=headers) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                else:
-                    raise Exception(f"Failed to get user connections: {await resp.text()}")
+        status, body = await self._request('GET', '/users/@me/connections')
+        if status == 200:
+            return body
+        else:
+            raise Exception(f"Failed to get user connections: {body}")
+    
+    def get_cached_users_summary(self) -> Optional[str]:
+        """Return the last users summary, scheduling a refresh when it is stale"""
+        cached = self._users_summary
+        if cached is None or time.monotonic() - cached[0] >= USERS_SUMMARY_TTL:
+            if self._users_summary_task is None or self._users_summary_task.done():
+                self._users_summary_task = asyncio.create_task(self._refresh_users_summary())
+        return cached[1] if cached else None
+    
+    async def _refresh_users_summary(self):
+        """Rebuild the cached users summary"""
+        try:
+            summary = await self.get_available_users_summary()
+            self._users_summary = (time.monotonic(), summary)
+        except Exception as e:
+            print(f"Could not get users summary: {e}")
     
     async def get_available_users_summary(self) -> str:
         """Get a summary of available users for messaging guidance"""
         summary_parts = []
         
+        # Friends and guilds are independent requests; fetch them together
+        relationships, guilds = await asyncio.gather(
+            self.get_user_relationships(), self.get_user_guilds(), return_exceptions=True
+        )
+        
         # Try to get friends (likely to fail due to Discord API restrictions)
         try:
-            relationships = await self.get_user_relationships()
+            if isinstance(relationships, Exception):
+                raise relationships
             if relationships:
                 friends = []
                 for rel in relationships:
                     user = rel.get('user', {})
                     if user and user.get('username'):
-                        username = user.get('username', '')
-                        discriminator = user.get('discriminator', '0')
-                        display_name = f"{username}#{discriminator}" if discriminator != '0' else username
-                        friends.append(display_name)
+                        friends.append(_display_name(user))
                 
                 if friends:
                     summary_parts.append(f"**Your friends ({len(friends)}):** {', '.join(friends[:5])}")
@@ -780,31 +1049,33 @@ class DiscordAPIClient:
         
         # Get guild information
         try:
-            guilds = await self.get_user_guilds()
+            if isinstance(guilds, Exception):
+                raise guilds
             if guilds:
                 accessible_guilds = []
                 sample_users = []
+                seen_users = set()
                 
-                # Try to get a sample of users from accessible guilds
-                for guild in guilds[:3]:  # Check first 3 guilds
-                    guild_name = guild.get('name', 'Unknown')
-                    guild_id = guild['id']
-                    
-                    try:
-                        members = await self.get_guild_members_sample(guild_id, 10)  # Small sample
-                        if members:
-                            accessible_guilds.append(guild_name)
-                            # Add some sample usernames
-                            for member in members[:3]:
-                                user = member.get('user', {})
-                                if user and user.get('username'):
-                                    username = user.get('username', '')
-                                    discriminator = user.get('discriminator', '0')
-                                    display_name = f"{username}#{discriminator}" if discriminator != '0' else username
-                                    if display_name not in sample_users:
-                                        sample_users.append(display_name)
-                    except Exception:
+                # Try to get a sample of users from accessible guilds, first 3
+                # guilds fetched concurrently (small samples)
+                samples = await asyncio.gather(
+                    *(self.get_guild_members_sample(guild['id'], 10) for guild in guilds[:3]),
+                    return_exceptions=True
+                )
+                for guild, members in zip(guilds, samples):
+                    # Skip guilds whose member list couldn't be fetched
+                    if isinstance(members, Exception) or not members:
                         continue
+                    
+                    accessible_guilds.append(guild.get('name', 'Unknown'))
+                    # Add some sample usernames
+                    for member in members[:3]:
+                        user = member.get('user', {})
+                        if user and user.get('username'):
+                            display_name = _display_name(user)
+                            if display_name not in seen_users:
+                                seen_users.add(display_name)
+                                sample_users.append(display_name)
                 
                 if accessible_guilds:
                     summary_parts.append(f"**Accessible servers ({len(accessible_guilds)}):** {', '.join(accessible_guilds)}")
@@ -824,17 +1095,9 @@ class DiscordAPIClient:
             return "**No accessible users found.**\n💡 Try using Discord User IDs directly for reliable messaging."
 
 
-class MessageProcessor:
-    """Processes natural language commands using ASI:One LLM"""
-    
-    @staticmethod
-    async def extract_message_intent(text: str) -> Dict:
-        """Extract intent and parameters from natural language text"""
-        try:
-            response = asi_client.chat.completions.create(
-                model="asi1-mini",
-                messages=[
-                    {"role": "system", "content": """
+# Static ASI:One system prompts, built once so every request reuses the same
+# message objects (and providers can cache the stable prefix)
+_INTENT_SYSTEM_MSG = {"role": "system", "content": """
 You are a Discord message intent parser. Analyze user requests and extract structured information.
 
 For sending messages, look for patterns like:
@@ -871,10 +1134,73 @@ Respond only with valid JSON:
     "target": "username to get messages from",
     "limit": 10
 }
-                    """},
+"""}
+_INTENT_MSGS_PREFIX = (_INTENT_SYSTEM_MSG,)
+
+_RESPONSE_SYSTEM_MSG = {"role": "system", "content": """
+You are a helpful Discord assistant. Generate natural, conversational responses about Discord actions.
+
+For successful message sending: Confirm the message was sent
+For message retrieval: Summarize the messages naturally
+For errors: Explain what went wrong and suggest solutions
+Keep responses concise and user-friendly.
+"""}
+_RESPONSE_MSGS_PREFIX = (_RESPONSE_SYSTEM_MSG,)
+
+# Intent JSON is small; cap the completion so we don't pay for long replies
+INTENT_MAX_TOKENS = 120
+
+# Fast-path patterns for deterministic commands that don't need the LLM.
+# The send pattern only accepts "Send <recipient>: <message>" where the recipient
+# is unambiguous, a user ID or name#discriminator; bare words ("Tell me: a joke",
+# "Text everyone: ...") and looser phrasings still go to ASI:One.
+_AUTH_RE = re.compile(r'^\s*(authenticate|login|log in|connect\b.*\bdiscord)\b', re.I)
+_SEND_RE = re.compile(r'^\s*(?:send|text|message|tell)\s+(\d{17,19}|@?[^\s:#@]+#\d{1,5})\s*:\s*(.+?)\s*$', re.I | re.S)
+_HELP_RE = re.compile(r'^\s*(help|what can you do|commands?)\s*[?.!]*\s*$', re.I)
+
+
+def match_fast_intent(text: str) -> Optional[Dict]:
+    """Match trivial commands locally, returning None when the LLM is needed"""
+    if _HELP_RE.match(text):
+        return {"action": "help"}
+    if _AUTH_RE.match(text):
+        return {"action": "authenticate"}
+    match = _SEND_RE.match(text)
+    if match:
+        return {"action": "send_message", "recipient": match.group(1).lstrip('@'), "message": match.group(2)}
+    return None
+
+
+def _stream_completion(**kwargs) -> str:
+    """Run a streaming ASI:One completion and return the accumulated text"""
+    parts = []
+    for chunk in asi_client.chat.completions.create(stream=True, **kwargs):
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+    return ''.join(parts)
+
+
+class MessageProcessor:
+    """Processes natural language commands using ASI:One LLM"""
+    
+    @staticmethod
+    async def extract_message_intent(text: str) -> Dict:
+        """Extract intent and parameters from natural language text"""
+        fast_intent = match_fast_intent(text)
+        if fast_intent:
+            return fast_intent
+        
+        try:
+            # The OpenAI client is blocking; run it in a worker thread so
+            # concurrent intent extractions actually overlap
+            response = await asyncio.to_thread(
+                asi_client.chat.completions.create,
+                model="asi1-mini",
+                messages=[
+                    *_INTENT_MSGS_PREFIX,
                     {"role": "user", "content": text}
                 ],
-                max_tokens=200,
+                max_tokens=INTENT_MAX_TOKENS,
                 temperature=0.1
             )
             
@@ -886,36 +1212,45 @@ Respond only with valid JSON:
             elif response_text.startswith('```'):
                 response_text = response_text[3:-3]
                 
-            return json.loads(response_text)
+            return orjson.loads(response_text)
             
         except Exception as e:
             print(f"Error parsing intent: {e}")
             return {"action": "help", "error": str(e)}
     
+    @staticmethod
+    async def extract_message_intents(texts: List[str]) -> List[Dict]:
+        """Extract intents for several independent texts concurrently, in input order"""
+        # Cap the fan-out so a long batch doesn't flood ASI:One and time out
+        semaphore = asyncio.Semaphore(ASI_MAX_CONCURRENCY)
+        
+        async def extract(text: str) -> Dict:
+            async with semaphore:
+                return await MessageProcessor.extract_message_intent(text)
+        
+        return list(await asyncio.gather(*(extract(text) for text in texts)))
+    
     @staticmethod
     async def generate_response(intent: Dict, result: str) -> str:
         """Generate natural language response based on action result"""
         try:
             context = f"Intent: {intent}, Result: {result}"
             
-            response = asi_client.chat.completions.create(
+            # Stream in a worker thread so the event loop keeps serving other
+            # messages while the completion is generated
+            response_text = await asyncio.to_thread(
+                _stream_completion,
                 model="asi1-mini",
                 messages=[
-                    {"role": "system", "content": """
-You are a helpful Discord assistant. Generate natural, conversational responses about Discord actions.
-
-For successful message sending: Confirm the message was sent
-For message retrieval: Summarize the messages naturally
-For errors: Explain what went wrong and suggest solutions
-Keep responses concise and user-friendly.
-                    """},
+                    *_RESPONSE_MSGS_PREFIX,
                     {"role": "user", "content": context}
                 ],
                 max_tokens=300,
-                temperature=0.3
+                temperature=0.3,
+                stop=["\n\n\n"]
             )
             
-            return response.choices[0].message.content.strip()
+            return response_text.strip()
             
         except Exception as e:
             return f"Action completed, but couldn't generate response: {str(e)}"
@@ -940,6 +1275,37 @@ auth_manager = DiscordAuthManager()
 discord_client = DiscordAPIClient(auth_manager)
 message_processor = MessageProcessor()
 
+# Actions whose results are already formatted for the user, so handle_message
+# returns them directly instead of paying for a generate_response round-trip
+_SKIP_LLM_ACTIONS = {'send_message', 'authenticate', 'help'}
+
+# Classification of send_message failures into user-facing explanations
+# Substring matches, as in "HTTP403"; when several kinds appear, the first
+# kind in _SEND_ERROR_PRIORITY decides the message
+_SEND_ERROR_RE = re.compile(r'403|forbidden|404|not found|401|unauthorized', re.I)
+_SEND_ERROR_PRIORITY = ('forbidden', 'not_found', 'unauthorized')
+_SEND_ERROR_KINDS = {
+    '403': 'forbidden', 'forbidden': 'forbidden',
+    '404': 'not_found', 'not found': 'not_found',
+    '401': 'unauthorized', 'unauthorized': 'unauthorized',
+}
+_SEND_ERROR_MESSAGES = {
+    'forbidden': "❌ **Permission denied** when trying to message {recipient}.\n\n"
+                 "**This could be because:**\n"
+                 "• The user has blocked you\n"
+                 "• The user doesn't accept DMs from non-friends\n"
+                 "• Your privacy settings don't allow this\n"
+                 "• Your Discord token lacks necessary permissions\n\n"
+                 "💡 **Try:** Sending them a friend request first",
+    'not_found': "❌ **User not found:** '{recipient}'\n\n"
+                 "💡 **Please try:**\n"
+                 "• Using their full username (Ben#1234)\n"
+                 "• Using their Discord User ID\n"
+                 "• Checking the spelling",
+    'unauthorized': "🔐 Discord authentication failed. Your token may be expired.\n"
+                    "Type 'authenticate' to refresh your Discord connection.",
+}
+
 # Create chat protocol
 protocol = Protocol(spec=chat_protocol_spec)
 # Enhanced message handler with integrated OAuth flow
@@ -977,18 +1343,18 @@ async def handle_discord_action(intent: Dict) -> str:
                        "• 'Text user ID 123456789: How are you?'"
             
             try:
-                print(f"🔍 Looking for Discord user: '{recipient}'")
+                logger.debug("🔍 Looking for Discord user: '%s'", recipient)
                 
                 # Step 1: Find the user by username or ID with comprehensive search
                 target_user = None
                 
                 # Check if recipient looks like a user ID (all digits)
                 if recipient.isdigit() and len(recipient) >= 17:  # Discord IDs are typically 17-19 digits
-                    print(f"📋 Searching by User ID: {recipient}")
+                    logger.debug("📋 Searching by User ID: %s", recipient)
                     target_user = await discord_client.find_user_by_id(recipient)
                 else:
                     # Try to find by username (includes friends and guild search)
-                    print(f"👤 Searching by username: {recipient}")
+                    logger.debug("👤 Searching by username: %s", recipient)
                     target_user = await discord_client.find_user_by_username(recipient)
                 
                 if not target_user:
@@ -999,8 +1365,7 @@ async def handle_discord_action(intent: Dict) -> str:
                     try:
                         relationships = await discord_client.get_user_relationships()
                         friends = [rel.get('user', {}) for rel in relationships if rel.get('user')]
-                        friend_names = [f"{u.get('username', '')}#{u.get('discriminator', '')}" 
-                                      for u in friends[:5] if u.get('username')]
+                        friend_names = [_display_name(u) for u in friends[:5] if u.get('username')]
                         if friend_names:
                             suggestions.append(f"Your friends: {', '.join(friend_names)}")
                     except Exception:
@@ -1019,12 +1384,10 @@ async def handle_discord_action(intent: Dict) -> str:
                     return error_msg
                 
                 # Step 2: Send the DM
-                print(f"📨 Sending message to {target_user.get('username')}...")
+                logger.debug("📨 Sending message to %s...", target_user.get('username'))
                 result = await discord_client.send_dm_to_user(target_user['id'], message)
                 
-                username = target_user.get('username', recipient)
-                discriminator = target_user.get('discriminator', '0')
-                display_name = f"{username}#{discriminator}" if discriminator and discriminator != '0' else username
+                display_name = _display_name(target_user, recipient)
                 
                 return f"✅ **Message sent successfully!**\n" \
                        f"👤 **To:** {display_name}\n" \
@@ -1032,31 +1395,13 @@ async def handle_discord_action(intent: Dict) -> str:
                        f"🎯 **Via:** Your Discord account"
                        
             except Exception as e:
-                error_msg = str(e).lower()
-                print(f"❌ Error sending message: {e}")
+                logger.warning("❌ Error sending message: %s", e)
                 
-                if "403" in error_msg or "forbidden" in error_msg:
-                    return f"❌ **Permission denied** when trying to message {recipient}.\n\n" \
-                           f"**This could be because:**\n" \
-                           f"• The user has blocked you\n" \
-                           f"• The user doesn't accept DMs from non-friends\n" \
-                           f"• Your privacy settings don't allow this\n" \
-                           f"• Your Discord token lacks necessary permissions\n\n" \
-                           f"💡 **Try:** Sending them a friend request first"
-                           
-                elif "404" in error_msg or "not found" in error_msg:
-                    return f"❌ **User not found:** '{recipient}'\n\n" \
-                           f"💡 **Please try:**\n" \
-                           f"• Using their full username (Ben#1234)\n" \
-                           f"• Using their Discord User ID\n" \
-                           f"• Checking the spelling"
-                    
-                elif "unauthorized" in error_msg or "401" in error_msg:
-                    return f"🔐 Discord authentication failed. Your token may be expired.\n" \
-                           f"Type 'authenticate' to refresh your Discord connection."
-                           
-                else:
-                    return f"❌ Failed to send message to {recipient}: {str(e)[:100]}"
+                found = {_SEND_ERROR_KINDS[match.lower()] for match in _SEND_ERROR_RE.findall(str(e))}
+                for kind in _SEND_ERROR_PRIORITY:
+                    if kind in found:
+                        return _SEND_ERROR_MESSAGES[kind].format(recipient=recipient)
+                return f"❌ Failed to send message to {recipient}: {_truncate(e, 100)}"
             
         elif action == 'get_messages':
             target = intent.get('target')
@@ -1098,12 +1443,11 @@ async def handle_discord_action(intent: Dict) -> str:
 
 """
             
-            # Try to add available users information
-            try:
-                users_summary = await discord_client.get_available_users_summary()
+            # Add available users information if we have it cached; a stale or
+            # missing summary is refreshed in the background for the next help
+            users_summary = discord_client.get_cached_users_summary()
+            if users_summary:
                 help_text += f"**📋 Available for messaging:**\n{users_summary}\n\n"
-            except Exception as e:
-                print(f"Could not get users summary: {e}")
                 
             help_text += "I can help you send DMs and retrieve message history! 🚀"
             return help_text
@@ -1153,10 +1497,12 @@ async def complete_oauth_flow():
 @protocol.on_message(ChatMessage)
 async def handle_message(ctx: Context, sender: str, msg: ChatMessage):
     """Handle incoming chat messages with Discord integration"""
+    now = datetime.now(timezone.utc)
+    
     # Send acknowledgment
     await ctx.send(
         sender,
-        ChatAcknowledgement(timestamp=datetime.now(), acknowledged_msg_id=msg.msg_id),
+        ChatAcknowledgement(timestamp=now, acknowledged_msg_id=msg.msg_id),
     )
     
     # Collect text content
@@ -1175,8 +1521,12 @@ async def handle_message(ctx: Context, sender: str, msg: ChatMessage):
         # Execute Discord action based on intent
         result = await handle_discord_action(intent)
         
-        # Generate natural language response
-        response = await message_processor.generate_response(intent, result)
+        # Results for these actions are already user-ready; skip the LLM rewrite
+        if intent.get('action') in _SKIP_LLM_ACTIONS:
+            response = result
+        else:
+            # Generate natural language response
+            response = await message_processor.generate_response(intent, result)
         
         # Fallback to direct result if response generation fails
         if not response or "couldn't generate response" in response:
@@ -1195,7 +1545,7 @@ Make sure your Discord credentials are configured in the .env file!"""
     
     # Send response back to user
     await ctx.send(sender, ChatMessage(
-        timestamp=datetime.utcnow(),
+        timestamp=now,
         msg_id=uuid4(),
         content=[
             TextContent(type="text", text=response),
@@ -1263,34 +1613,41 @@ async def shutdown_handler(ctx: Context):
     """Clean up resources on agent shutdown"""
     ctx.logger.info("🛑 Discord Agent shutting down...")
     # Clean up any running OAuth server
-    auth_manager._cleanup_server()
+    await auth_manager._cleanup_server()
+    await discord_client.close()
 
 
 # Include the protocol with the agent
 agent.include(protocol, publish_manifest=True)
 
-# Agent information
-print("=" * 60)
-print("🎯 DISCORD AGENT - Enhanced Messaging & OAuth Integration")
-print("=" * 60)
-print(f"Agent Address: {agent.address}")
-print(f"Agent Port: 8005")
-print(f"Mailbox Enabled: True")
-print()
-print("🔧 FEATURES:")
-print("• Discord OAuth2 Authentication")
-print("• Direct Message Sending")
-print("• Message History Retrieval") 
-print("• Natural Language Processing (ASI:One)")
-print("• Secure Token Management")
-print()
-print("💡 EXAMPLE COMMANDS:")
-print('• "Send Ben: I\'ll be 10 minutes late"')
-print('• "Show my last messages from Alice"')
-print('• "Text everyone: Meeting moved to 3pm"')
-print()
-print("🚀 Starting agent...")
-print("=" * 60)
+def print_startup_banner():
+    """Print the agent information banner in a single write"""
+    print("\n".join([
+        "=" * 60,
+        "🎯 DISCORD AGENT - Enhanced Messaging & OAuth Integration",
+        "=" * 60,
+        f"Agent Address: {agent.address}",
+        "Agent Port: 8005",
+        "Mailbox Enabled: True",
+        "",
+        "🔧 FEATURES:",
+        "• Discord OAuth2 Authentication",
+        "• Direct Message Sending",
+        "• Message History Retrieval",
+        "• Natural Language Processing (ASI:One)",
+        "• Secure Token Management",
+        "",
+        "💡 EXAMPLE COMMANDS:",
+        '• "Send Ben: I\'ll be 10 minutes late"',
+        '• "Show my last messages from Alice"',
+        '• "Text everyone: Meeting moved to 3pm"',
+        "",
+        "🚀 Starting agent...",
+        "=" * 60,
+    ]))
 
 if __name__ == "__main__":
+    # Only show the banner to an interactive terminal, not service logs
+    if sys.stdout.isatty():
+        print_startup_banner()
     agent.run()
@@ -7,117 +7,242 @@ and provides guidance on finding Discord User IDs for reliable messaging.
 """
 
 import asyncio
+import hashlib
+from itertools import islice
+from operator import itemgetter
+import random
 import sys
-import os
+import time
 
-# Add current directory to path
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import aiohttp
 
-async def diagnose_discord_permissions():
-    """Diagnose Discord API access and limitations"""
-    print("=" * 70)
-    print("🩺 DISCORD API PERMISSIONS DIAGNOSTIC")
-    print("=" * 70)
-    
+try:
+    from . import discord_agent
+    from .discord_agent import DiscordAuthManager, DiscordAPIClient
+except ImportError:
+    # Run as a script: the script's own directory is already on sys.path
+    import discord_agent
+    from discord_agent import DiscordAuthManager, DiscordAPIClient
+
+# Guilds whose member lists are sampled concurrently at a time
+GUILD_BATCH_SIZE = 10
+
+def chunked(iterable, size: int):
+    """Yield successive lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+# Section separators for console output
+_BANNER = "=" * 70
+_HEADER_SEP = "\n" + _BANNER
+
+# Discord User IDs are 64-bit snowflakes with at least 17 digits
+_MIN_USER_ID, _MAX_USER_ID = 10 ** 16, 1 << 64
+
+def is_valid_user_id(user_id: str) -> bool:
+    """Check that a string looks like a Discord User ID"""
     try:
-        from discord_agent import DiscordAuthManager, DiscordAPIClient
-        
-        # Initialize components
+        value = int(user_id)
+    except ValueError:
+        return False
+    # int() also accepts signs and underscores, so confirm plain digits last
+    return _MIN_USER_ID <= value < _MAX_USER_ID and user_id.isdigit()
+
+def validate_ids(ids: list) -> list:
+    """Return the entries of ids that are valid Discord User IDs"""
+    return [user_id for user_id in ids if is_valid_user_id(user_id)]
+
+# Discord user objects always carry these fields
+_USER_FIELDS = itemgetter('username', 'discriminator', 'id')
+
+def _user_rows(users: list, indent: str) -> list:
+    """Format Discord users as '- name#discriminator (ID: id)' rows"""
+    return [f"{indent}- {username}#{discriminator} (ID: {user_id})"
+            for username, discriminator, user_id in map(_USER_FIELDS, users)]
+
+def _write_lines(lines):
+    """Write collected output lines to stdout in a single call"""
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+
+async def _retry(factory, max_tries: int = 4, base: float = 0.5):
+    """Await factory() with exponential backoff on transient network errors.
+    
+    HTTP 429s are already retried inside DiscordAPIClient; this covers
+    dropped connections and timeouts so one flaky round-trip doesn't fail
+    the whole diagnostic.
+    """
+    for attempt in range(max_tries):
+        try:
+            return await factory()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if attempt == max_tries - 1:
+                raise
+            await asyncio.sleep(base * 2 ** attempt + random.random() * 0.1)
+
+# In-flight User ID lookups, so concurrent duplicates share one request
+_inflight = {}
+
+async def lookup_once(discord_client, user_id: str):
+    """find_user_by_id with single-flight de-duplication of concurrent calls"""
+    task = _inflight.get(user_id)
+    if task is None:
+        task = _inflight[user_id] = asyncio.create_task(discord_client.find_user_by_id(user_id))
+        task.add_done_callback(lambda _: _inflight.pop(user_id, None))
+    return await asyncio.shield(task)
+
+# Results of per-account Discord endpoints, keyed by (endpoint, token hash), so
+# composed diagnostics don't fetch the same data twice in one run
+_api_cache = {}
+
+async def _cached_call(endpoint: str, token: str, fetch):
+    """Return the memoized result of fetch() for this endpoint and token"""
+    key = (endpoint, hashlib.blake2b(token.encode(), digest_size=16).digest())
+    if key not in _api_cache:
+        _api_cache[key] = await fetch()
+    return _api_cache[key]
+
+async def cached_get_current_user(discord_client, token: str):
+    """Memoized DiscordAPIClient.get_current_user for the run"""
+    return await _cached_call('users/@me', token, discord_client.get_current_user)
+
+async def cached_get_current_authorization_info(discord_client, token: str):
+    """Memoized DiscordAPIClient.get_current_authorization_info for the run"""
+    return await _cached_call('oauth2/@me', token, discord_client.get_current_authorization_info)
+
+async def cached_get_user_guilds(discord_client, token: str):
+    """Memoized DiscordAPIClient.get_user_guilds for the run"""
+    return await _cached_call('users/@me/guilds', token, discord_client.get_user_guilds)
+
+# Shared (auth_manager, discord_client, token, expires_at) for the diagnostic run
+_CACHED = None
+
+async def _get_clients():
+    """Get shared Discord clients and a valid token, revalidating only near expiry"""
+    global _CACHED
+    
+    if _CACHED:
+        auth_manager, discord_client, token, expires_at = _CACHED
+        if token and expires_at and expires_at - time.time() > 60:
+            return auth_manager, discord_client, token
+    else:
         auth_manager = DiscordAuthManager()
         discord_client = DiscordAPIClient(auth_manager)
-        
-        # Check authentication
-        valid_token = await auth_manager.get_valid_token()
+    
+    token = await auth_manager.get_valid_token()
+    _CACHED = (auth_manager, discord_client, token, auth_manager.token_expires_at)
+    return auth_manager, discord_client, token
+
+async def _diagnose_discord_permissions(out, guild_limit):
+    """Run the permission diagnostic, emitting output lines via out()"""
+    out(_BANNER)
+    out("🩺 DISCORD API PERMISSIONS DIAGNOSTIC")
+    out(_BANNER)
+    
+    try:
+        # Initialize components and check authentication
+        auth_manager, discord_client, valid_token = await _get_clients()
         if not valid_token:
-            print("❌ No valid Discord token found")
-            print("   Run: python test_complete_oauth_flow.py first")
+            out("❌ No valid Discord token found")
+            out("   Run: python test_complete_oauth_flow.py first")
             return False
         
-        print("✅ Discord authentication valid")
+        out("✅ Discord authentication valid")
         
         # Test current user access
-        print("\n👤 Testing basic user access...")
+        out("\n👤 Testing basic user access...")
         try:
-            current_user = await discord_client.get_current_user()
+            current_user = await cached_get_current_user(discord_client, valid_token)
             username = current_user.get('username', 'Unknown')
             discriminator = current_user.get('discriminator', '0000')
             user_id = current_user.get('id', 'Unknown')
-            print(f"   ✅ Current user: {username}#{discriminator} (ID: {user_id})")
+            out(f"   ✅ Current user: {username}#{discriminator} (ID: {user_id})")
         except Exception as e:
-            print(f"   ❌ Failed: {e}")
+            out(f"   ❌ Failed: {e}")
             return False
         
         # Test friends list access
-        print("\n👥 Testing friends list access...")
+        out("\n👥 Testing friends list access...")
         try:
+            # The client already turns failures into an empty list, so there is nothing to retry
             relationships = await discord_client.get_user_relationships()
             if relationships:
-                print(f"   ✅ Friends list accessible - {len(relationships)} relationships found")
-                for rel in relationships[:3]:
-                    user = rel.get('user', {})
-                    if user:
-                        username = user.get('username', 'Unknown')
-                        discriminator = user.get('discriminator', '0')
-                        user_id = user.get('id', 'Unknown')
-                        print(f"      - {username}#{discriminator} (ID: {user_id})")
+                out(f"   ✅ Friends list accessible - {len(relationships)} relationships found")
+                rows = _user_rows([rel['user'] for rel in relationships[:3] if rel.get('user')], "      ")
+                if rows:
+                    out("\n".join(rows))
             else:
-                print("   ⚠️  Friends list returned empty (Discord API restriction)")
-                print("   📖 Discord has restricted user token access to friends list")
+                out("   ⚠️  Friends list returned empty (Discord API restriction)")
+                out("   📖 Discord has restricted user token access to friends list")
         except Exception as e:
-            print(f"   ❌ Friends list access denied: {e}")
-            print("   📖 This is expected - Discord restricts this API for user tokens")
+            out(f"   ❌ Friends list access denied: {e}")
+            out("   📖 This is expected - Discord restricts this API for user tokens")
         
         # Test guild access
-        print("\n🏰 Testing guild access...")
+        out("\n🏰 Testing guild access...")
         try:
-            guilds = await discord_client.get_user_guilds()
+            guilds = await _retry(lambda: cached_get_user_guilds(discord_client, valid_token))
             if guilds:
-                print(f"   ✅ Guild list accessible - {len(guilds)} guilds found")
+                out(f"   ✅ Guild list accessible - {len(guilds)} guilds found")
                 
                 accessible_count = 0
-                for guild in guilds[:5]:  # Test first 5 guilds
+                sampled_guilds = guilds[:guild_limit]  # Test first guild_limit guilds
+                
+                # Fetch member samples in concurrent batches of GUILD_BATCH_SIZE so
+                # accounts in hundreds of guilds don't fire every request at once;
+                # the client's limiter keeps this under Discord's global rate limit
+                results = {}
+                for batch in chunked(sampled_guilds, GUILD_BATCH_SIZE):
+                    results.update(await discord_client.get_guild_members_sample_batch(
+                        [guild['id'] for guild in batch], per_guild=5
+                    ))
+                
+                for guild in sampled_guilds:
                     guild_name = guild.get('name', 'Unknown')
-                    guild_id = guild['id']
+                    members = results[guild['id']]
                     
                     try:
-                        members = await discord_client.get_guild_members_sample(guild_id, 5)
                         if members:
                             accessible_count += 1
-                            print(f"      ✅ {guild_name}: {len(members)} members accessible")
+                            out(f"      ✅ {guild_name}: {len(members)} members accessible")
                             
                             # Show sample users with IDs
-                            for member in members[:2]:
-                                user = member.get('user', {})
-                                if user:
-                                    username = user.get('username', 'Unknown')
-                                    discriminator = user.get('discriminator', '0')
-                                    user_id = user.get('id', 'Unknown')
-                                    print(f"         - {username}#{discriminator} (ID: {user_id})")
+                            rows = _user_rows([member['user'] for member in members[:2] if member.get('user')], "         ")
+                            if rows:
+                                out("\n".join(rows))
                         else:
-                            print(f"      ⚠️  {guild_name}: Member list not accessible")
+                            out(f"      ⚠️  {guild_name}: Member list not accessible")
                     except Exception as e:
-                        print(f"      ❌ {guild_name}: {e}")
+                        out(f"      ❌ {guild_name}: {e}")
                 
-                print(f"\n   📊 Summary: {accessible_count}/{min(len(guilds), 5)} guilds have accessible member lists")
+                out(f"\n   📊 Summary: {accessible_count}/{len(sampled_guilds)} guilds have accessible member lists")
                 
             else:
-                print("   ❌ No guilds found")
+                out("   ❌ No guilds found")
         except Exception as e:
-            print(f"   ❌ Guild access failed: {e}")
+            out(f"   ❌ Guild access failed: {e}")
         
         return True
         
     except Exception as e:
-        print(f"❌ Diagnostic failed: {e}")
+        out(f"❌ Diagnostic failed: {e}")
         return False
 
-def print_user_id_guide():
-    """Print guide for finding Discord User IDs"""
-    print("\n" + "=" * 70)
-    print("🆔 HOW TO FIND DISCORD USER IDs")
-    print("=" * 70)
-    
-    print("""
+async def diagnose_discord_permissions(guild_limit: int = 5):
+    """Diagnose Discord API access and limitations for the first guild_limit guilds"""
+    lines = []
+    try:
+        return await _diagnose_discord_permissions(lines.append, guild_limit)
+    finally:
+        _write_lines(lines)
+
+_USER_ID_GUIDE = "\n".join([
+    "",
+    _BANNER,
+    "🆔 HOW TO FIND DISCORD USER IDs",
+    _BANNER,
+    """
 **Why User IDs are better than usernames:**
 • Usernames can be changed, User IDs are permanent
 • No need to remember discriminator (#1234)
@@ -149,33 +274,44 @@ Use: "Send user ID 123456789012345678: Hello there"
 • "DM 456789123456789123 that I'll be late"
 
 This bypasses all username lookup issues and works reliably!
-""")
+""",
+    "",
+])
+
+def print_user_id_guide():
+    """Print guide for finding Discord User IDs"""
+    sys.stdout.write(_USER_ID_GUIDE)
 
 async def test_user_id_lookup():
     """Test User ID lookup functionality"""
-    print("\n" + "=" * 70)
-    print("🔍 TESTING USER ID LOOKUP")
-    print("=" * 70)
+    print(f"{_HEADER_SEP}\n🔍 TESTING USER ID LOOKUP\n{_BANNER}")
     
     print("Enter a Discord User ID to test lookup (or press Enter to skip):")
-    user_input = input("User ID: ").strip()
+    # Warm up the Discord clients while waiting for the user to type
+    user_input, clients = await asyncio.gather(
+        asyncio.to_thread(input, "User ID: "),
+        _get_clients(),
+        return_exceptions=True
+    )
+    if isinstance(user_input, BaseException):
+        raise user_input
+    user_input = user_input.strip()
     
     if not user_input:
         print("Skipping User ID test")
         return True
     
-    if not user_input.isdigit() or len(user_input) < 17:
-        print("❌ Invalid User ID format (should be 17-19 digits)")
+    if not is_valid_user_id(user_input):
+        print("❌ Invalid User ID format (should be 17-20 digits)")
         return False
     
     try:
-        from discord_agent import DiscordAuthManager, DiscordAPIClient
-        
-        auth_manager = DiscordAuthManager()
-        discord_client = DiscordAPIClient(auth_manager)
+        if isinstance(clients, Exception):
+            raise clients
+        auth_manager, discord_client, _ = clients
         
         print(f"🔍 Looking up User ID: {user_input}")
-        user = await discord_client.find_user_by_id(user_input)
+        user = await _retry(lambda: lookup_once(discord_client, user_input))
         
         if user:
             username = user.get('username', 'Unknown')
@@ -206,9 +342,7 @@ async def main():
     # Test User ID lookup
     user_id_result = await test_user_id_lookup()
     
-    print("\n" + "=" * 70)
-    print("📋 DIAGNOSTIC SUMMARY & RECOMMENDATIONS")
-    print("=" * 70)
+    print(f"{_HEADER_SEP}\n📋 DIAGNOSTIC SUMMARY & RECOMMENDATIONS\n{_BANNER}")
     
     if diagnostic_result:
         print("✅ Discord API access working")
@@ -246,70 +380,82 @@ import json
 import os
 from datetime import datetime
 
-async def check_discord_permissions():
-    """Check what permissions the current Discord token has"""
-    print("=" * 70)
-    print("🔍 DISCORD API PERMISSIONS CHECKER")
-    print("=" * 70)
+async def _check_discord_permissions(out):
+    """Run the permission check, emitting output lines via out()"""
+    out(_BANNER)
+    out("🔍 DISCORD API PERMISSIONS CHECKER")
+    out(_BANNER)
     
     try:
-        from discord_agent import auth_manager, discord_client
+        auth_manager = discord_agent.auth_manager
+        discord_client = discord_agent.discord_client
         
         # Check if we have a valid token
         token = await auth_manager.get_valid_token()
         if not token:
-            print("❌ No valid Discord token found")
-            print("   Run: python test_complete_oauth_flow.py first")
+            out("❌ No valid Discord token found")
+            out("   Run: python test_complete_oauth_flow.py first")
             return False
         
-        print("✅ Valid Discord token found")
+        out("✅ Valid Discord token found")
+        
+        # Probe the independent endpoints concurrently
+        out("\n📋 Testing Discord API endpoints...")
+        user_info, auth_info, guilds = await asyncio.gather(
+            cached_get_current_user(discord_client, token),
+            cached_get_current_authorization_info(discord_client, token),
+            cached_get_user_guilds(discord_client, token),
+            return_exceptions=True
+        )
         
         # Test current user endpoint
-        print("\n📋 Testing Discord API endpoints...")
-        try:
-            user_info = await discord_client.get_current_user()
-            print(f"✅ /users/@me: {user_info.get('username')}#{user_info.get('discriminator')}")
-        except Exception as e:
-            print(f"❌ /users/@me failed: {e}")
+        if isinstance(user_info, Exception):
+            out(f"❌ /users/@me failed: {user_info}")
+        else:
+            out(f"✅ /users/@me: {user_info.get('username')}#{user_info.get('discriminator')}")
         
         # Test authorization info
-        try:
-            auth_info = await discord_client.get_current_authorization_info()
+        if isinstance(auth_info, Exception):
+            out(f"❌ Authorization info failed: {auth_info}")
+        else:
             scopes = auth_info.get('scopes', [])
-            print(f"✅ Current scopes: {', '.join(scopes)}")
+            out(f"✅ Current scopes: {', '.join(scopes)}")
             
             # Check if we have the necessary scopes for messaging
             required_scopes = ['identify', 'guilds']  # Basic scopes
             missing_scopes = [scope for scope in required_scopes if scope not in scopes]
             
             if missing_scopes:
-                print(f"⚠️  Missing scopes: {', '.join(missing_scopes)}")
+                out(f"⚠️  Missing scopes: {', '.join(missing_scopes)}")
             else:
-                print("✅ All basic scopes present")
-                
-        except Exception as e:
-            print(f"❌ Authorization info failed: {e}")
+                out("✅ All basic scopes present")
         
         # Test guilds endpoint
-        try:
-            guilds = await discord_client.get_user_guilds()
-            print(f"✅ /users/@me/guilds: Found {len(guilds)} guilds")
-        except Exception as e:
-            print(f"❌ /users/@me/guilds failed: {e}")
+        if isinstance(guilds, Exception):
+            out(f"❌ /users/@me/guilds failed: {guilds}")
+        else:
+            out(f"✅ /users/@me/guilds: Found {len(guilds)} guilds")
         
         return True
         
     except Exception as e:
-        print(f"❌ Permission check failed: {e}")
+        out(f"❌ Permission check failed: {e}")
         return False
 
-def print_discord_limitations():
-    """Print information about Discord API limitations"""
-    print("\n" + "=" * 70)
-    print("⚠️  DISCORD API LIMITATIONS FOR USER TOKENS")
-    print("=" * 70)
-    
-    print("""
+async def check_discord_permissions():
+    """Check what permissions the current Discord token has"""
+    lines = []
+    try:
+        return await _check_discord_permissions(lines.append)
+    finally:
+        _write_lines(lines)
+
+_DISCORD_LIMITATIONS = "\n".join([
+    "",
+    _BANNER,
+    "⚠️  DISCORD API LIMITATIONS FOR USER TOKENS",
+    _BANNER,
+    """
 🚫 IMPORTANT LIMITATIONS:
 
 1. **Direct Messaging Restrictions**
@@ -352,15 +498,20 @@ def print_discord_limitations():
    • Convert to Discord Bot implementation
    • Use bot tokens with proper permissions
    • Or integrate with Discord's official SDKs
-""")
+""",
+    "",
+])
 
-async def suggest_solutions():
-    """Suggest alternative approaches for Discord messaging"""
-    print("\n" + "=" * 70)
-    print("💡 RECOMMENDED SOLUTIONS")
-    print("=" * 70)
-    
-    print("""
+def print_discord_limitations():
+    """Print information about Discord API limitations"""
+    sys.stdout.write(_DISCORD_LIMITATIONS)
+
+_SOLUTIONS_GUIDE = "\n".join([
+    "",
+    _BANNER,
+    "💡 RECOMMENDED SOLUTIONS",
+    _BANNER,
+    """
 🤖 **SOLUTION 1: Convert to Discord Bot**
 
 1. Create a Discord Bot Application:
@@ -407,7 +558,13 @@ For specific channels:
 The agent implementation is correct in structure but limited by
 Discord's API restrictions. The code would work if Discord allowed
 user token messaging or if converted to use bot tokens.
-""")
+""",
+    "",
+])
+
+async def suggest_solutions():
+    """Suggest alternative approaches for Discord messaging"""
+    sys.stdout.write(_SOLUTIONS_GUIDE)
 
 async def main():
     """Main diagnostic function"""
@@ -423,9 +580,7 @@ async def main():
     # Suggest solutions
     await suggest_solutions()
     
-    print("\n" + "=" * 70)
-    print("📋 SUMMARY")
-    print("=" * 70)
+    print(f"{_HEADER_SEP}\n📋 SUMMARY\n{_BANNER}")
     print("• Your discord_agent code structure is correct")
     print("• Discord API limitations prevent user token messaging")
     print("• Consider converting to Discord Bot for full functionality")
@@ -9,25 +9,50 @@ requiring them to go through the OAuth flow again.
 
 import asyncio
 import json
-import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 from dotenv import load_dotenv
-import sys
+import httpx
+import orjson
 
-# Add the current directory to the path so we can import the agent modules
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+try:
+    from .discord_agent import DiscordAuthManager
+except ImportError:
+    # Run as a script: the script's own directory is already on sys.path
+    from discord_agent import DiscordAuthManager
 
-from discord_agent import DiscordAuthManager
+# Section separators for console output
+_BANNER = "=" * 60
+_HEADER_SEP = "\n" + _BANNER
 
 # Load environment variables
 load_dotenv()
 
+# Shared HTTP/2 client so Discord API calls reuse one multiplexed connection
+_session: Optional[httpx.AsyncClient] = None
+
+async def _get_session() -> httpx.AsyncClient:
+    """Get the shared HTTP client, creating it on first use"""
+    global _session
+    if _session is None or _session.is_closed:
+        _session = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+            timeout=10
+        )
+    return _session
+
+async def _close_session():
+    """Close the shared HTTP client"""
+    global _session
+    if _session and not _session.is_closed:
+        await _session.aclose()
+    _session = None
+
 async def save_tokens_from_test_results():
     """Save tokens from the successful OAuth2 test flow"""
     
-    print("=" * 60)
-    print("🔐 SAVING DISCORD OAUTH2 TOKENS")
-    print("=" * 60)
+    print(f"{_BANNER}\n🔐 SAVING DISCORD OAUTH2 TOKENS\n{_BANNER}")
     
     # Get the tokens from your test results
     # You'll need to replace these with the actual tokens from your test output
@@ -57,7 +82,7 @@ async def save_tokens_from_test_results():
         "token_type": token_type,
         "expires_in": expires_in,
         "scope": scope,
-        "timestamp": datetime.now().isoformat()  # For our records
+        "timestamp": datetime.now(timezone.utc).isoformat()  # For our records
     }
     
     print("\n🔧 Token data prepared:")
@@ -72,48 +97,37 @@ async def save_tokens_from_test_results():
     
     try:
         print("\n💾 Saving tokens to encrypted storage...")
-        await auth_manager.save_tokens(token_data)
+        # save_tokens keeps the token in memory, so there's no need to reload
+        # and decrypt the file just to get it back
+        valid_token = await auth_manager.save_tokens(token_data)
+        
+        if not valid_token:
+            print("❌ Tokens were not saved! Check that ENCRYPTION_KEY is set.")
+            return False
+        
         print("✅ Tokens saved successfully!")
+        print("✅ Token is valid and ready to use!")
+        print(f"   Valid Token: {valid_token[:20]}...")
+        
+        # Test with Discord API to verify it works
+        print("\n👤 Testing with Discord API...")
+        headers = {
+            'Authorization': f'Bearer {valid_token}',
+            'User-Agent': 'VocalAgent Discord Bot'
+        }
         
-        # Verify the tokens were saved correctly
-        print("\n🔍 Verifying saved tokens...")
-        if await auth_manager.load_tokens():
-            print("✅ Tokens loaded successfully from storage!")
+        session = await _get_session()
+        resp = await session.get('https://discord.com/api/v10/users/@me', headers=headers)
+        if resp.status_code == 200:
+            user_data = orjson.loads(resp.content)
+            username = user_data.get('username', 'Unknown')
+            discriminator = user_data.get('discriminator', '0')
+            print(f"✅ API test successful! Authenticated as: {username}#{discriminator}")
             
-            # Test token validity
-            print("\n🧪 Testing token validity...")
-            valid_token = await auth_manager.get_valid_token()
-            if valid_token:
-                print("✅ Token is valid and ready to use!")
-                print(f"   Valid Token: {valid_token[:20]}...")
-                
-                # Test with Discord API to verify it works
-                print("\n👤 Testing with Discord API...")
-                import aiohttp
-                
-                headers = {
-                    'Authorization': f'Bearer {valid_token}',
-                    'User-Agent': 'VocalAgent Discord Bot'
-                }
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.get('https://discord.com/api/v10/users/@me', headers=headers) as resp:
-                        if resp.status == 200:
-                            user_data = await resp.json()
-                            username = user_data.get('username', 'Unknown')
-                            discriminator = user_data.get('discriminator', '0')
-                            print(f"✅ API test successful! Authenticated as: {username}#{discriminator}")
-                            
-                            return True
-                        else:
-                            print(f"⚠️  API test failed: {resp.status}")
-                            print(f"   Response: {await resp.text()}")
-                            return False
-            else:
-                print("❌ Token validation failed!")
-                return False
+            return True
         else:
-            print("❌ Failed to load saved tokens!")
+            print(f"⚠️  API test failed: {resp.status_code}")
+            print(f"   Response: {resp.text}")
             return False
             
     except Exception as e:
@@ -128,7 +142,7 @@ async def main():
     try:
         success = await save_tokens_from_test_results()
         
-        print("\n" + "=" * 60)
+        print(_HEADER_SEP)
         if success:
             print("🎉 TOKENS SAVED SUCCESSFULLY!")
             print("   Your Discord agent can now authenticate automatically!")
@@ -140,12 +154,14 @@ async def main():
         else:
             print("❌ TOKEN SAVING FAILED!")
             print("   Please check the errors above and try again.")
-        print("=" * 60)
+        print(_BANNER)
         
     except KeyboardInterrupt:
         print("\n⚠️  Operation cancelled by user")
     except Exception as e:
         print(f"\n❌ Unexpected error: {e}")
+    finally:
+        await _close_session()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
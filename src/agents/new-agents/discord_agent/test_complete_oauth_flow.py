@@ -8,16 +8,19 @@ It starts a local callback server and guides you through the authorization proce
 
 import os
 import asyncio
+import html
 import webbrowser
 import secrets
-import json
-from datetime import datetime, timedelta
-from urllib.parse import urlparse, parse_qs, urlencode
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import threading
-import requests
+from urllib.parse import urlparse, urlencode
+import aiohttp
+from aiohttp import web
 from dotenv import load_dotenv
-from cryptography.fernet import Fernet
+
+try:
+    from .token_storage import SecureTokenStorage
+except ImportError:
+    # Run as a script: the script's own directory is already on sys.path
+    from token_storage import SecureTokenStorage
 
 # Load environment variables
 load_dotenv()
@@ -27,131 +30,80 @@ DISCORD_CLIENT_ID = os.getenv("DISCORD_CLIENT_ID")
 DISCORD_CLIENT_SECRET = os.getenv("DISCORD_CLIENT_SECRET")
 DISCORD_REDIRECT_URI = os.getenv("DISCORD_REDIRECT_URI", "http://localhost:8080/callback")
 
-# Encryption key for secure token storage (same as discord_agent.py)
-ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", Fernet.generate_key().decode())
+# Callback pages, encoded once; the error page is filled by bytes.replace
+_INVALID_STATE_HTML = """
+    <html>
+    <head><title>Discord OAuth2 Test - Error</title></head>
+    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
+        <h1 style="color: #dc3545;">🔒 Security Error: Invalid State</h1>
+        <p>The authorization request may have been tampered with.</p>
+        <p>Please close this window and try again.</p>
+    </body>
+    </html>
+""".encode('utf-8')
 
-class SecureTokenStorage:
-    """Secure token storage using encryption - matches discord_agent.py implementation"""
-    
-    def __init__(self):
-        self.token_file = "discord_tokens.enc"
-        self.cipher = Fernet(ENCRYPTION_KEY.encode()) if ENCRYPTION_KEY else None
-    
-    def save_tokens(self, token_data: dict) -> bool:
-        """Securely save tokens to encrypted file"""
-        try:
-            if not self.cipher:
-                print("⚠️  Warning: No encryption key available, tokens not saved")
-                return False
-            
-            # Add timestamp for expiry calculation
-            token_data_with_timestamp = {
-                **token_data,
-                'saved_at': datetime.now().isoformat(),
-                'expires_at': (datetime.now() + timedelta(seconds=token_data.get('expires_in', 3600))).isoformat()
-            }
-            
-            encrypted_data = self.cipher.encrypt(json.dumps(token_data_with_timestamp).encode())
-            with open(self.token_file, 'wb') as f:
-                f.write(encrypted_data)
-            
-            print("🔐 Tokens securely saved to encrypted file")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Error saving tokens: {e}")
-            return False
-    
-    def load_tokens(self) -> dict:
-        """Load and decrypt saved tokens"""
-        try:
-            if not os.path.exists(self.token_file) or not self.cipher:
-                return None
-                
-            with open(self.token_file, 'rb') as f:
-                encrypted_data = f.read()
-                
-            decrypted_data = self.cipher.decrypt(encrypted_data)
-            token_data = json.loads(decrypted_data.decode())
-            
-            return token_data
-            
-        except Exception as e:
-            print(f"❌ Error loading tokens: {e}")
-            return None
+_SUCCESS_HTML = """
+    <html>
+    <head><title>Discord OAuth2 Test - Success</title></head>
+    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
+        <h1 style="color: #28a745;">✅ Discord Authorization Successful!</h1>
+        <p>Authorization code received successfully.</p>
+        <p>You can close this window and return to the terminal to see the results.</p>
+        <script>setTimeout(() => window.close(), 5000);</script>
+    </body>
+    </html>
+""".encode('utf-8')
+
+_ERROR_HTML_TMPL = """
+    <html>
+    <head><title>Discord OAuth2 Test - Error</title></head>
+    <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
+        <h1 style="color: #dc3545;">❌ Discord Authorization Failed</h1>
+        <p><strong>Error:</strong> __ERROR__</p>
+        <p><strong>Description:</strong> __DESCRIPTION__</p>
+        <p>Please close this window and try again.</p>
+    </body>
+    </html>
+""".encode('utf-8')
 
-class OAuthCallbackHandler(BaseHTTPRequestHandler):
-    """Handles OAuth2 callback from Discord"""
+def build_callback_app(expected_state: str, result: asyncio.Future) -> web.Application:
+    """Build the aiohttp app that handles the OAuth2 callback from Discord"""
     
-    def do_GET(self):
+    def resolve(code, error):
+        # Only the first callback counts; later requests (e.g. reloads) are ignored
+        if not result.done():
+            result.set_result((code, error))
+    
+    async def handle_callback(request: web.Request) -> web.Response:
         """Handle GET request from Discord OAuth callback"""
-        parsed_path = urlparse(self.path)
-        query_params = parse_qs(parsed_path.query)
+        query_params = request.query
         
         # Validate state parameter for CSRF protection
-        received_state = query_params.get('state', [None])[0]
-        expected_state = getattr(self.server, 'expected_state', None)
-        
-        if received_state != expected_state:
-            self.server.authorization_error = "invalid_state"
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write("""
-                <html>
-                <head><title>Discord OAuth2 Test - Error</title></head>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
-                    <h1 style="color: #dc3545;">🔒 Security Error: Invalid State</h1>
-                    <p>The authorization request may have been tampered with.</p>
-                    <p>Please close this window and try again.</p>
-                </body>
-                </html>
-            """.encode('utf-8'))
-            return
+        if query_params.get('state') != expected_state:
+            resolve(None, "invalid_state")
+            return web.Response(status=400, body=_INVALID_STATE_HTML, content_type='text/html', charset='utf-8')
         
         if 'code' in query_params:
             # Success - authorization code received
-            self.server.authorization_code = query_params['code'][0]
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write("""
-                <html>
-                <head><title>Discord OAuth2 Test - Success</title></head>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
-                    <h1 style="color: #28a745;">✅ Discord Authorization Successful!</h1>
-                    <p>Authorization code received successfully.</p>
-                    <p>You can close this window and return to the terminal to see the results.</p>
-                    <script>setTimeout(() => window.close(), 5000);</script>
-                </body>
-                </html>
-            """.encode('utf-8'))
-        elif 'error' in query_params:
+            resolve(query_params['code'], None)
+            return web.Response(body=_SUCCESS_HTML, content_type='text/html', charset='utf-8')
+        
+        if 'error' in query_params:
             # Error in authorization
-            error = query_params.get('error', ['unknown'])[0]
-            error_description = query_params.get('error_description', [''])[0]
-            self.server.authorization_error = error
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(f"""
-                <html>
-                <head><title>Discord OAuth2 Test - Error</title></head>
-                <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 50px auto; padding: 20px;">
-                    <h1 style="color: #dc3545;">❌ Discord Authorization Failed</h1>
-                    <p><strong>Error:</strong> {error}</p>
-                    <p><strong>Description:</strong> {error_description}</p>
-                    <p>Please close this window and try again.</p>
-                </body>
-                </html>
-            """.encode('utf-8'))
+            error = query_params.get('error', 'unknown')
+            error_description = query_params.get('error_description', '')
+            resolve(None, error)
+            body = (_ERROR_HTML_TMPL
+                    .replace(b'__ERROR__', html.escape(error).encode('utf-8'))
+                    .replace(b'__DESCRIPTION__', html.escape(error_description).encode('utf-8')))
+            return web.Response(status=400, body=body, content_type='text/html', charset='utf-8')
         
-        # Stop the server after handling the request
-        threading.Thread(target=self.server.shutdown).start()
+        resolve(None, None)
+        return web.Response(status=400)
     
-    def log_message(self, format, *args):
-        """Suppress server log messages"""
-        pass
+    app = web.Application()
+    app.router.add_get(urlparse(DISCORD_REDIRECT_URI).path or '/callback', handle_callback)
+    return app
 
 async def run_complete_oauth_flow():
     """Run complete OAuth2 flow with Discord"""
@@ -174,86 +126,88 @@ async def run_complete_oauth_flow():
     
     print(f"🔧 Starting callback server on port {callback_port}...")
     
-    # Start local callback server
-    server = HTTPServer(('localhost', callback_port), OAuthCallbackHandler)
-    server.authorization_code = None
-    server.authorization_error = None
-    
     # Generate state for CSRF protection
     state = secrets.token_urlsafe(32)
-    server.expected_state = state
     
-    # Start server in background thread
-    server_thread = threading.Thread(target=server.serve_forever)
-    server_thread.daemon = True
-    server_thread.start()
+    # Start local callback server on this event loop; the handler resolves
+    # callback_result with (authorization_code, authorization_error)
+    callback_result = asyncio.get_running_loop().create_future()
+    runner = web.AppRunner(build_callback_app(state, callback_result))
+    await runner.setup()
+    site = web.TCPSite(runner, 'localhost', callback_port)
+    await site.start()
     
     # Generate OAuth URL
     scopes = ['identify', 'guilds']  # Basic scopes that don't require approval
-    oauth_url = (
-        f"https://discord.com/oauth2/authorize?"
-        f"client_id={DISCORD_CLIENT_ID}&"
-        f"redirect_uri={DISCORD_REDIRECT_URI}&"
-        f"response_type=code&"
-        f"scope={'+'.join(scopes)}&"
-        f"state={state}"
-    )
+    params = {
+        'client_id': DISCORD_CLIENT_ID,
+        'redirect_uri': DISCORD_REDIRECT_URI,
+        'response_type': 'code',
+        'scope': ' '.join(scopes),
+        'state': state
+    }
+    oauth_url = f"https://discord.com/oauth2/authorize?{urlencode(params)}"
     
     print(f"\n🔗 Opening Discord authorization URL...")
     print(f"URL: {oauth_url}")
     print(f"\n📍 If the browser doesn't open automatically, copy and paste the URL above")
     print("⏳ Waiting for you to authorize the application...")
     
-    # Open browser
-    webbrowser.open(oauth_url)
+    # Open browser in a worker thread without waiting; the callback server is
+    # already serving, and the URL above is the fallback if this fails
+    browser_task = asyncio.create_task(asyncio.to_thread(webbrowser.open, oauth_url))
     
     # Wait for callback with timeout
     timeout_seconds = 120  # 2 minutes
-    elapsed = 0
     
-    while server.authorization_code is None and server.authorization_error is None and elapsed < timeout_seconds:
-        await asyncio.sleep(1)
-        elapsed += 1
-        if elapsed % 10 == 0:
+    async def report_progress():
+        for elapsed in range(10, timeout_seconds, 10):
+            await asyncio.sleep(10)
             print(f"   Still waiting... ({elapsed}/{timeout_seconds}s)")
     
-    # Clean up server
-    server.shutdown()
-    server.server_close()
-    
-    if elapsed >= timeout_seconds:
+    progress_task = asyncio.create_task(report_progress())
+    try:
+        authorization_code, authorization_error = await asyncio.wait_for(
+            callback_result, timeout=timeout_seconds
+        )
+    except asyncio.TimeoutError:
         print("⏰ Authorization timed out after 2 minutes")
         return False
+    finally:
+        progress_task.cancel()
+        # Clean up server
+        await runner.cleanup()
     
-    if server.authorization_error:
-        print(f"❌ Authorization failed: {server.authorization_error}")
+    if authorization_error:
+        print(f"❌ Authorization failed: {authorization_error}")
         return False
     
-    if not server.authorization_code:
+    if not authorization_code:
         print("❌ No authorization code received")
         return False
     
-    print(f"✅ Authorization code received: {server.authorization_code[:20]}...")
+    print(f"✅ Authorization code received: {authorization_code[:20]}...")
     
     # Exchange code for token
     print("\n🔄 Exchanging authorization code for access token...")
     
     try:
-        token_response = requests.post(
-            'https://discord.com/api/v10/oauth2/token',
-            data={
-                'grant_type': 'authorization_code',
-                'code': server.authorization_code,
-                'redirect_uri': DISCORD_REDIRECT_URI
-            },
-            headers={
-                'Content-Type': 'application/x-www-form-urlencoded'
-            },
-            auth=(DISCORD_CLIENT_ID, DISCORD_CLIENT_SECRET)  # HTTP Basic authentication
-        )
-        
-        if token_response.status_code == 200:
-            token_data = token_response.json()
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                'https://discord.com/api/v10/oauth2/token',
+                data={
+                    'grant_type': 'authorization_code',
+                    'code': authorization_code,
+                    'redirect_uri': DISCORD_REDIRECT_URI
+                },
+                auth=aiohttp.BasicAuth(DISCORD_CLIENT_ID, DISCORD_CLIENT_SECRET)  # HTTP Basic authentication
+            ) as token_response:
+                if token_response.status != 200:
+                    print(f"❌ Token exchange failed: {token_response.status}")
+                    print(f"   Response: {await token_response.text()}")
+                    return False
+                token_data = await token_response.json()
+            
             print("✅ Successfully obtained access token!")
             print(f"   Token Type: {token_data.get('token_type')}")
             print(f"   Expires In: {token_data.get('expires_in')} seconds")
@@ -265,59 +219,66 @@ async def run_complete_oauth_flow():
             
             # Save tokens securely for discord_agent to use
             print("\n💾 Saving tokens securely...")
-            token_storage = SecureTokenStorage()
-            if token_storage.save_tokens(token_data):
-                print("✅ Tokens saved successfully! discord_agent can now use them automatically.")
-            else:
+            try:
+                if await SecureTokenStorage().save_tokens(token_data):
+                    print("🔐 Tokens securely saved to encrypted file")
+                    print("✅ Tokens saved successfully! discord_agent can now use them automatically.")
+                else:
+                    print("⚠️  Warning: No encryption key available, tokens not saved")
+                    print("⚠️  Warning: Token save failed - you may need to re-authenticate")
+            except Exception as e:
+                print(f"❌ Error saving tokens: {e}")
                 print("⚠️  Warning: Token save failed - you may need to re-authenticate")
             
-            # Test the token by getting user info
-            print("\n👤 Testing access token by getting user info...")
-            user_response = requests.get(
-                'https://discord.com/api/v10/users/@me',
-                headers={'Authorization': f"Bearer {token_data['access_token']}"}
-            )
+            # Test the token by getting user info, fetching guilds alongside it
+            # when the guilds scope was granted
+            bearer = {'Authorization': f"Bearer {token_data['access_token']}"}
             
-            if user_response.status_code == 200:
-                user_data = user_response.json()
-                username = user_data.get('username', 'Unknown')
-                discriminator = user_data.get('discriminator', '0')
-                user_id = user_data.get('id', 'Unknown')
-                
-                print(f"✅ Successfully authenticated as:")
-                print(f"   Username: {username}#{discriminator}")
-                print(f"   User ID: {user_id}")
-                print(f"   Avatar: {user_data.get('avatar', 'None')}")
-                
-                # Test guild access if available
-                if 'guilds' in token_data.get('scope', ''):
-                    print("\n🏰 Testing guild access...")
-                    guilds_response = requests.get(
-                        'https://discord.com/api/v10/users/@me/guilds',
-                        headers={'Authorization': f"Bearer {token_data['access_token']}"}
-                    )
-                    
-                    if guilds_response.status_code == 200:
-                        guilds = guilds_response.json()
-                        print(f"✅ User is in {len(guilds)} guild(s)")
-                        for guild in guilds[:3]:  # Show first 3 guilds
-                            print(f"   - {guild.get('name', 'Unknown')} (ID: {guild.get('id')})")
-                        if len(guilds) > 3:
-                            print(f"   ... and {len(guilds) - 3} more")
-                    else:
-                        print(f"⚠️  Guild access failed: {guilds_response.status_code}")
-                
-                print("\n🎉 Complete OAuth2 flow test successful!")
-                print("📡 discord_agent can now authenticate automatically using saved tokens")
-                return True
+            async def fetch(url):
+                async with session.get(url, headers=bearer) as response:
+                    if response.status == 200:
+                        return response.status, await response.json()
+                    return response.status, await response.text()
+            
+            check_guilds = 'guilds' in token_data.get('scope', '')
+            print("\n👤 Testing access token by getting user info...")
+            if check_guilds:
+                (user_status, user_data), (guilds_status, guilds) = await asyncio.gather(
+                    fetch('https://discord.com/api/v10/users/@me'),
+                    fetch('https://discord.com/api/v10/users/@me/guilds'),
+                )
             else:
-                print(f"❌ Token validation failed: {user_response.status_code}")
-                print(f"   Response: {user_response.text}")
-                return False
-        else:
-            print(f"❌ Token exchange failed: {token_response.status_code}")
-            print(f"   Response: {token_response.text}")
+                user_status, user_data = await fetch('https://discord.com/api/v10/users/@me')
+        
+        if user_status != 200:
+            print(f"❌ Token validation failed: {user_status}")
+            print(f"   Response: {user_data}")
             return False
+        
+        username = user_data.get('username', 'Unknown')
+        discriminator = user_data.get('discriminator', '0')
+        user_id = user_data.get('id', 'Unknown')
+        
+        print(f"✅ Successfully authenticated as:")
+        print(f"   Username: {username}#{discriminator}")
+        print(f"   User ID: {user_id}")
+        print(f"   Avatar: {user_data.get('avatar', 'None')}")
+        
+        # Report guild access if available
+        if check_guilds:
+            print("\n🏰 Testing guild access...")
+            if guilds_status == 200:
+                print(f"✅ User is in {len(guilds)} guild(s)")
+                for guild in guilds[:3]:  # Show first 3 guilds
+                    print(f"   - {guild.get('name', 'Unknown')} (ID: {guild.get('id')})")
+                if len(guilds) > 3:
+                    print(f"   ... and {len(guilds) - 3} more")
+            else:
+                print(f"⚠️  Guild access failed: {guilds_status}")
+        
+        print("\n🎉 Complete OAuth2 flow test successful!")
+        print("📡 discord_agent can now authenticate automatically using saved tokens")
+        return True
             
     except Exception as e:
         print(f"❌ Error during token exchange: {e}")
@@ -347,4 +308,10 @@ async def main():
         return False
 
 if __name__ == "__main__":
+    # uvloop is optional; fall back to the stock event loop without it
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
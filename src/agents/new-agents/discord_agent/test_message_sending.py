@@ -36,10 +36,12 @@ async def test_message_parsing():
             "Tell Dave I finished the task"
         ]
         
-        for i, message in enumerate(test_messages, 1):
+        # The parses are independent ASI:One calls, so issue them together
+        intents = await MessageProcessor.extract_message_intents(test_messages)
+        
+        for i, (message, intent) in enumerate(zip(test_messages, intents), 1):
             print(f"\n{i}. Testing: \"{message}\"")
             try:
-                intent = await MessageProcessor.extract_message_intent(message)
                 print(f"   ✅ Parsed: {intent}")
                 
                 # Validate required fields
@@ -137,11 +139,13 @@ async def main():
     """Run all tests"""
     print("🚀 Discord Agent Message Sending Test Suite")
     
-    # Test 1: Message parsing
-    parsing_result = await test_message_parsing()
-    
-    # Test 2: Discord connection (only if tokens exist)
-    connection_result = await test_discord_connection()
+    # Tests 1 and 2: message parsing (ASI:One) and Discord connection (only
+    # if tokens exist) share no state, so run them concurrently
+    parsing_result, connection_result = await asyncio.gather(
+        test_message_parsing(), test_discord_connection(), return_exceptions=True
+    )
+    parsing_result = parsing_result is True
+    connection_result = connection_result is True
     
     # Test 3: Full flow test
     flow_result = await test_full_message_flow()
@@ -149,11 +153,16 @@ async def main():
     print("\n" + "=" * 70)
     print("📊 TEST RESULTS SUMMARY")
     print("=" * 70)
-    print(f"Message Parsing: {'✅ PASS' if parsing_result else '❌ FAIL'}")
-    print(f"Discord Connection: {'✅ PASS' if connection_result else '❌ FAIL'}")
-    print(f"Message Flow: {'✅ PASS' if flow_result else '❌ FAIL'}")
+    results = {
+        'Message Parsing': parsing_result,
+        'Discord Connection': connection_result,
+        'Message Flow': flow_result
+    }
+    for name, passed in results.items():
+        print(f"{name}: {'✅ PASS' if passed else '❌ FAIL'}")
+    all_pass = all(results.values())
     
-    if parsing_result and connection_result and flow_result:
+    if all_pass:
         print("\n🎉 ALL TESTS PASSED!")
         print("Your Discord agent is ready to send messages!")
         print("\n📋 Next steps:")
@@ -169,7 +178,13 @@ async def main():
         if not flow_result:
             print("• Check discord_agent.py implementation")
     
-    return parsing_result and connection_result and flow_result
+    return all_pass
 
 if __name__ == "__main__":
+    # uvloop is optional; fall back to the stock event loop without it
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
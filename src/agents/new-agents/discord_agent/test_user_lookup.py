@@ -9,17 +9,21 @@ Run this after completing OAuth authentication.
 """
 
 import asyncio
+import io
 import sys
-import os
 
-# Add current directory to path
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Test output is collected here and written in one go by main()
+_report = io.StringIO()
+
+def log(*args):
+    """Append a line to the buffered test report"""
+    print(*args, file=_report)
 
 async def test_user_lookup():
     """Test the improved user lookup functionality"""
-    print("=" * 70)
-    print("🔍 TESTING ENHANCED DISCORD USER LOOKUP")
-    print("=" * 70)
+    log("=" * 70)
+    log("🔍 TESTING ENHANCED DISCORD USER LOOKUP")
+    log("=" * 70)
     
     try:
         from discord_agent import DiscordAuthManager, DiscordAPIClient
@@ -31,27 +35,36 @@ async def test_user_lookup():
         # Check if we have valid authentication
         valid_token = await auth_manager.get_valid_token()
         if not valid_token:
-            print("❌ No valid Discord token found")
-            print("   Run: python test_complete_oauth_flow.py first")
+            log("❌ No valid Discord token found")
+            log("   Run: python test_complete_oauth_flow.py first")
             return False
         
-        print("✅ Discord authentication valid")
+        log("✅ Discord authentication valid")
+        
+        # The API probes don't depend on each other, so fetch them all at
+        # once and report on each result below
+        current_user, relationships, guilds, summary = await asyncio.gather(
+            discord_client.get_current_user(),
+            discord_client.get_user_relationships(),
+            discord_client.get_user_guilds(),
+            discord_client.get_available_users_summary(),
+            return_exceptions=True
+        )
         
         # Test 1: Get current user info
-        print("\n📋 Getting current user info...")
-        try:
-            current_user = await discord_client.get_current_user()
-            username = current_user.get('username', 'Unknown')
-            discriminator = current_user.get('discriminator', '0000')
-            print(f"   Current user: {username}#{discriminator}")
-        except Exception as e:
-            print(f"   ❌ Failed: {e}")
+        log("\n📋 Getting current user info...")
+        if isinstance(current_user, Exception):
+            log(f"   ❌ Failed: {current_user}")
             return False
+        username = current_user.get('username', 'Unknown')
+        discriminator = current_user.get('discriminator', '0000')
+        log(f"   Current user: {username}#{discriminator}")
         
         # Test 2: Get friends list
-        print("\n👥 Getting friends list...")
+        log("\n👥 Getting friends list...")
         try:
-            relationships = await discord_client.get_user_relationships()
+            if isinstance(relationships, Exception):
+                raise relationships
             friends = []
             for rel in relationships:
                 user = rel.get('user', {})
@@ -62,64 +75,66 @@ async def test_user_lookup():
                     friends.append(display_name)
             
             if friends:
-                print(f"   ✅ Found {len(friends)} friends:")
+                log(f"   ✅ Found {len(friends)} friends:")
                 for friend in friends[:5]:  # Show first 5
-                    print(f"      - {friend}")
+                    log(f"      - {friend}")
                 if len(friends) > 5:
-                    print(f"      ... and {len(friends) - 5} more")
+                    log(f"      ... and {len(friends) - 5} more")
             else:
-                print("   ℹ️  No friends found (or friends list not accessible)")
+                log("   ℹ️  No friends found (or friends list not accessible)")
                 
         except Exception as e:
-            print(f"   ⚠️  Friends list access failed: {e}")
+            log(f"   ⚠️  Friends list access failed: {e}")
         
         # Test 3: Get guilds
-        print("\n🏰 Getting mutual guilds...")
+        log("\n🏰 Getting mutual guilds...")
         try:
-            guilds = await discord_client.get_user_guilds()
+            if isinstance(guilds, Exception):
+                raise guilds
             if guilds:
-                print(f"   ✅ Found {len(guilds)} mutual guilds:")
+                log(f"   ✅ Found {len(guilds)} mutual guilds:")
                 for guild in guilds[:3]:
-                    print(f"      - {guild.get('name', 'Unknown')}")
+                    log(f"      - {guild.get('name', 'Unknown')}")
                 if len(guilds) > 3:
-                    print(f"      ... and {len(guilds) - 3} more")
+                    log(f"      ... and {len(guilds) - 3} more")
             else:
-                print("   ℹ️  No mutual guilds found")
+                log("   ℹ️  No mutual guilds found")
         except Exception as e:
-            print(f"   ⚠️  Guild access failed: {e}")
+            log(f"   ⚠️  Guild access failed: {e}")
         
         # Test 4: Test username parsing
-        print("\n🔤 Testing username parsing...")
+        log("\n🔤 Testing username parsing...")
         test_usernames = ["Ben", "Alice#1234", "User#0001", "123456789"]
         
         for test_username in test_usernames:
             parsed = discord_client.parse_username(test_username)
-            print(f"   '{test_username}' → {parsed}")
+            log(f"   '{test_username}' → {parsed}")
         
         # Test 5: Get available users summary
-        print("\n📊 Getting available users summary...")
+        log("\n📊 Getting available users summary...")
         try:
-            summary = await discord_client.get_available_users_summary()
-            print(f"   Summary:\n{summary}")
+            if isinstance(summary, Exception):
+                raise summary
+            log(f"   Summary:\n{summary}")
         except Exception as e:
-            print(f"   ⚠️  Summary failed: {e}")
+            log(f"   ⚠️  Summary failed: {e}")
         
-        print("\n✅ User lookup test completed successfully!")
+        log("\n✅ User lookup test completed successfully!")
         return True
         
     except ImportError as e:
-        print(f"❌ Import error: {e}")
-        print("   Make sure discord_agent.py is in the current directory")
+        log(f"❌ Import error: {e}")
+        log("   Make sure discord_agent.py is in the current directory")
         return False
     except Exception as e:
-        print(f"❌ Test failed: {e}")
+        log(f"❌ Test failed: {e}")
         return False
 
 async def test_message_parsing():
     """Test that message parsing works correctly"""
-    print("\n" + "=" * 70)
-    print("🧠 TESTING MESSAGE PARSING")
-    print("=" * 70)
+    log("\n" + "=" * 70)
+    log("🧠 TESTING MESSAGE PARSING")
+    log("=" * 70)
     
     try:
         from discord_agent import MessageProcessor
@@ -132,29 +147,32 @@ async def test_message_parsing():
             "Message Sarah saying the meeting is cancelled"
         ]
         
-        for i, message in enumerate(test_messages, 1):
-            print(f"\n{i}. Testing: \"{message}\"")
+        # The parses are independent ASI:One calls; run them together
+        # (extract_message_intents bounds how many are in flight)
+        intents = await MessageProcessor.extract_message_intents(test_messages)
+        
+        for i, (message, intent) in enumerate(zip(test_messages, intents), 1):
+            log(f"\n{i}. Testing: \"{message}\"")
             try:
-                intent = await MessageProcessor.extract_message_intent(message)
-                print(f"   ✅ Parsed: {intent}")
+                log(f"   ✅ Parsed: {intent}")
                 
                 if intent.get('action') == 'send_message':
                     recipient = intent.get('recipient')
                     msg_content = intent.get('message')
                     if recipient and msg_content:
-                        print(f"   ✅ Valid: recipient='{recipient}', message='{msg_content}'")
+                        log(f"   ✅ Valid: recipient='{recipient}', message='{msg_content}'")
                     else:
-                        print(f"   ⚠️  Missing data: recipient='{recipient}', message='{msg_content}'")
+                        log(f"   ⚠️  Missing data: recipient='{recipient}', message='{msg_content}'")
                 else:
-                    print(f"   ⚠️  Unexpected action: {intent.get('action')}")
+                    log(f"   ⚠️  Unexpected action: {intent.get('action')}")
                     
             except Exception as e:
-                print(f"   ❌ Parsing failed: {e}")
+                log(f"   ❌ Parsing failed: {e}")
         
         return True
         
     except Exception as e:
-        print(f"❌ Message parsing test failed: {e}")
+        log(f"❌ Message parsing test failed: {e}")
         return False
 
 async def main():
@@ -162,11 +180,17 @@ async def main():
     print("🚀 Discord Agent Enhanced User Lookup Test Suite")
     
     # Test 1: User lookup capabilities
+    print("⏳ Running user lookup tests...", flush=True)
     lookup_result = await test_user_lookup()
     
     # Test 2: Message parsing
+    print("⏳ Running message parsing tests...", flush=True)
     parsing_result = await test_message_parsing()
     
+    # Write both tests' reports with a single write
+    sys.stdout.write(_report.getvalue())
+    sys.stdout.flush()
+    
     print("\n" + "=" * 70)
     print("📊 TEST RESULTS SUMMARY")
     print("=" * 70)
@@ -193,4 +217,10 @@ async def main():
     return lookup_result and parsing_result
 
 if __name__ == "__main__":
+    # uvloop is optional; fall back to the stock event loop without it
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     asyncio.run(main())
\ No newline at end of file
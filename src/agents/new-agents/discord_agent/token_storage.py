@@ -0,0 +1,121 @@
+"""
+Encrypted Discord token storage
+
+Shared by discord_agent.py and the OAuth test scripts so that the token
+file format, encryption and caching live in one place.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+import orjson
+from cryptography.fernet import Fernet
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Encryption key for secure token storage (generate once and store securely)
+ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY", Fernet.generate_key().decode())
+
+# Built once: Fernet() decodes the key and sets up its primitives on every call
+_CIPHER = Fernet(ENCRYPTION_KEY.encode()) if ENCRYPTION_KEY else None
+
+TOKEN_FILE = "discord_tokens.enc"
+EXPIRY_FILE = "discord_tokens.exp"  # Plaintext expires_at, readable without the key
+
+def parse_utc_timestamp(value) -> datetime:
+    """Parse a stored timestamp into an aware UTC datetime.
+    
+    Accepts ISO-8601 strings (naive values from older token files are read
+    as local time) and POSIX epoch seconds.
+    """
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed.astimezone(timezone.utc)
+
+def to_epoch_seconds(value) -> float:
+    """Convert a stored timestamp (epoch seconds or legacy ISO-8601 string) to epoch seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return parse_utc_timestamp(value).timestamp()
+
+class SecureTokenStorage:
+    """Secure token storage using Fernet encryption"""
+    
+    def __init__(self, token_file: str = TOKEN_FILE, expiry_file: str = EXPIRY_FILE):
+        self.token_file = token_file
+        self.expiry_file = expiry_file
+        self.cipher = _CIPHER
+        self._cache: Optional[Tuple[int, Dict]] = None  # (token file mtime_ns, decrypted data)
+    
+    async def save_tokens(self, token_data: Dict) -> Optional[Dict]:
+        """Encrypt and save tokens with saved_at/expires_at, returning the stored data.
+        
+        Timestamps are stored as epoch seconds. Returns None without writing
+        anything if no encryption key is available.
+        """
+        if not self.cipher:
+            return None
+        
+        now = time.time()
+        # Enhanced token data with timestamps for better expiry tracking
+        stored_data = {
+            **token_data,
+            'saved_at': now,
+            'expires_at': now + token_data.get('expires_in', 3600)
+        }
+        
+        encrypted_data = self.cipher.encrypt(orjson.dumps(stored_data))
+        # Write both files beside their targets and swap them in back to back,
+        # so an interrupted save never leaves a truncated file, or the new
+        # token beside a stale expiry from a slow second write
+        tmp_file = self.token_file + '.tmp'
+        async with aiofiles.open(tmp_file, 'wb') as f:
+            await f.write(encrypted_data)
+        tmp_expiry_file = self.expiry_file + '.tmp'
+        async with aiofiles.open(tmp_expiry_file, 'w') as f:
+            await f.write(repr(stored_data['expires_at']))
+        await aiofiles.os.replace(tmp_file, self.token_file)
+        await aiofiles.os.replace(tmp_expiry_file, self.expiry_file)
+        
+        return stored_data
+    
+    async def load_tokens(self) -> Optional[Dict]:
+        """Load and decrypt saved tokens, or None if there are none.
+        
+        Decryption errors propagate to the caller.
+        """
+        if not self.cipher:
+            return None
+        
+        # Reuse the last decrypt unless the file has been rewritten since
+        try:
+            mtime = (await aiofiles.os.stat(self.token_file)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if self._cache and self._cache[0] == mtime:
+            return self._cache[1]
+        
+        async with aiofiles.open(self.token_file, 'rb') as f:
+            encrypted_data = await f.read()
+        
+        token_data = orjson.loads(self.cipher.decrypt(encrypted_data))
+        self._cache = (mtime, token_data)
+        return token_data
+    
+    async def stored_expires_at(self) -> Optional[float]:
+        """Expiry (epoch seconds) of the saved token, read from the sidecar without decrypting"""
+        try:
+            async with aiofiles.open(self.expiry_file) as f:
+                return to_epoch_seconds((await f.read()).strip())
+        except (OSError, ValueError):
+            return None
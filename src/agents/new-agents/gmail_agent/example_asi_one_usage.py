@@ -7,16 +7,29 @@ using natural language through ASI:One.
 """
 
 import os
-import sys
-from datetime import datetime
-from uuid import uuid4
-
-# Add the current directory to the path
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from datetime import datetime, timezone
+from typing import Optional
+from uuid import UUID
 
 from uagents import Agent, Context
 from uagents_core.contrib.protocols.chat import ChatMessage, TextContent
 
+# Message IDs are cut from one os.urandom call per UUID_POOL_SIZE messages
+UUID_POOL_SIZE = 256
+_uuid_pool = iter(())
+
+
+def next_uuid() -> UUID:
+    """Return a random (version 4) UUID from the pre-generated pool"""
+    global _uuid_pool
+    
+    chunk = next(_uuid_pool, None)
+    if chunk is None:
+        random_bytes = os.urandom(16 * UUID_POOL_SIZE)
+        _uuid_pool = (random_bytes[i:i + 16] for i in range(0, len(random_bytes), 16))
+        chunk = next(_uuid_pool)
+    return UUID(bytes=chunk, version=4)
+
 
 def create_client_agent():
     """Create a client agent to communicate with the Gmail agent"""
@@ -35,15 +48,18 @@ def create_client_agent():
     return client_agent, GMAIL_AGENT_ADDRESS
 
 
-def send_natural_language_email(client_agent, gmail_agent_address, message):
-    """Send a natural language email request to the Gmail agent"""
+def send_natural_language_email(client_agent, gmail_agent_address, message, timestamp: Optional[datetime] = None):
+    """Send a natural language email request to the Gmail agent
+    
+    Pass the same timestamp for every message when sending a batch.
+    """
     
     print(f"Sending message: {message}")
     
     # Create chat message
     chat_message = ChatMessage(
-        timestamp=datetime.now(),
-        msg_id=uuid4(),
+        timestamp=timestamp or datetime.now(timezone.utc),
+        msg_id=next_uuid(),
         content=[TextContent(type="text", text=message)]
     )
     
@@ -51,6 +67,13 @@ def send_natural_language_email(client_agent, gmail_agent_address, message):
     client_agent.send(gmail_agent_address, chat_message)
 
 
+def send_natural_language_emails(client_agent, gmail_agent_address, messages):
+    """Send several natural language email requests, stamped with one shared timestamp"""
+    timestamp = datetime.now(timezone.utc)
+    for message in messages:
+        send_natural_language_email(client_agent, gmail_agent_address, message, timestamp)
+
+
 def main():
     """Main example function"""
     
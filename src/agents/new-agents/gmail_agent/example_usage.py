@@ -7,7 +7,8 @@ into a real application for sending notifications.
 """
 
 import asyncio
-from typing import Optional
+import random
+from typing import Callable, Dict, List, Optional
 from uagents import Agent, Context, Model
 
 # Import the same models as the Gmail agent
@@ -25,6 +26,14 @@ class EmailStatusResponse(Model):
     error_message: Optional[str] = None
     success: bool = False
 
+class EmailBatchSendRequest(Model):
+    """Request to send several emails at once"""
+    messages: List[EmailSendRequest]
+
+class EmailBatchStatusResponse(Model):
+    """Responses for a batch send, in request order"""
+    results: List[EmailStatusResponse]
+
 # Your application agent
 app_agent = Agent(
     name="My Application",
@@ -35,6 +44,25 @@ app_agent = Agent(
 # Gmail agent address (replace with your actual address)
 GMAIL_AGENT_ADDRESS = "agent1qw6kgumlfqp9drr54qsfngdkz50vgues3u7sewg2fgketekqk8hz500ytg3"
 
+# Emails collected for the next batch flush (see flush_pending_emails)
+pending_emails: List[EmailSendRequest] = []
+
+def queue_email(request: EmailSendRequest):
+    """Queue an email to go out with the next batch instead of on its own"""
+    pending_emails.append(request)
+
+# Example: Batch delivery - one Gmail round-trip per second instead of one per email
+@app_agent.on_interval(period=1)
+async def flush_pending_emails(ctx: Context):
+    """Send all queued emails to the Gmail agent as a single batch"""
+    if not pending_emails:
+        return
+    
+    batch = pending_emails[:]
+    pending_emails.clear()
+    ctx.logger.info(f"Sending batch of {len(batch)} emails...")
+    await ctx.send(GMAIL_AGENT_ADDRESS, EmailBatchSendRequest(messages=batch))
+
 # Example: User registration notification
 @app_agent.on_event("startup")
 async def send_welcome_email(ctx: Context):
@@ -51,9 +79,9 @@ async def send_welcome_email(ctx: Context):
 @app_agent.on_interval(period=300)  # Every 5 minutes
 async def health_check_notification(ctx: Context):
     """Send periodic health check email"""
-    ctx.logger.info("Sending health check notification...")
+    ctx.logger.info("Queueing health check notification...")
     
-    await ctx.send(GMAIL_AGENT_ADDRESS, EmailSendRequest(
+    queue_email(EmailSendRequest(
         to="admin@myapp.com",
         subject="System Health Check",
         body="All systems are running normally. Last check: 5 minutes ago."
@@ -99,45 +127,50 @@ async def handle_email_response(ctx: Context, sender: str, msg: EmailStatusRespo
         elif "auth" in msg.error_message.lower():
             ctx.logger.error("Authentication failed, check Google Cloud setup")
 
+@app_agent.on_message(EmailBatchStatusResponse)
+async def handle_email_batch_response(ctx: Context, sender: str, msg: EmailBatchStatusResponse):
+    """Handle batch responses from Gmail agent"""
+    for result in msg.results:
+        await handle_email_response(ctx, sender, result)
+
 # Example: Simulate some application events
+# (event_type, recipient, subject) choices for simulate_events
+_EVENTS = (
+    ("user_registration", "newuser@example.com", "User Registration"),
+    ("password_reset", "user@example.com", "Password Reset Request"),
+    ("order_confirmation", "customer@example.com", "Order Confirmation"),
+    ("system_alert", "admin@myapp.com", "System Alert")
+)
+
+# Builds the email for each event type from (recipient, subject)
+_EVENT_BUILDERS: Dict[str, Callable[[str, str], EmailSendRequest]] = {
+    "user_registration": lambda email, subject: EmailSendRequest(
+        to=email,
+        subject=f"Welcome! {subject}",
+        body="Thank you for joining our platform. Get started by exploring our features!"
+    ),
+    "password_reset": lambda email, subject: EmailSendRequest(
+        to=email,
+        subject=f"Password Reset - {subject}",
+        body="You requested a password reset. Click the link to reset your password."
+    ),
+    "order_confirmation": lambda email, subject: EmailSendRequest(
+        to=email,
+        subject=f"Order Confirmed - {subject}",
+        body="Your order has been confirmed and will be processed shortly."
+    ),
+    "system_alert": lambda email, subject: EmailSendRequest(
+        to=email,
+        subject=f"🚨 {subject}",
+        body="System monitoring detected an issue that requires attention."
+    )
+}
+
 @app_agent.on_interval(period=10)
 async def simulate_events(ctx: Context):
     """Simulate various application events that might trigger emails"""
-    import random
-    
-    events = [
-        ("user_registration", "newuser@example.com", "User Registration"),
-        ("password_reset", "user@example.com", "Password Reset Request"),
-        ("order_confirmation", "customer@example.com", "Order Confirmation"),
-        ("system_alert", "admin@myapp.com", "System Alert")
-    ]
-    
-    event_type, email, subject = random.choice(events)
-    
-    if event_type == "user_registration":
-        await ctx.send(GMAIL_AGENT_ADDRESS, EmailSendRequest(
-            to=email,
-            subject=f"Welcome! {subject}",
-            body="Thank you for joining our platform. Get started by exploring our features!"
-        ))
-    elif event_type == "password_reset":
-        await ctx.send(GMAIL_AGENT_ADDRESS, EmailSendRequest(
-            to=email,
-            subject=f"Password Reset - {subject}",
-            body="You requested a password reset. Click the link to reset your password."
-        ))
-    elif event_type == "order_confirmation":
-        await ctx.send(GMAIL_AGENT_ADDRESS, EmailSendRequest(
-            to=email,
-            subject=f"Order Confirmed - {subject}",
-            body="Your order has been confirmed and will be processed shortly."
-        ))
-    elif event_type == "system_alert":
-        await ctx.send(GMAIL_AGENT_ADDRESS, EmailSendRequest(
-            to=email,
-            subject=f"🚨 {subject}",
-            body="System monitoring detected an issue that requires attention."
-        ))
+    event_type, email, subject = random.choice(_EVENTS)
+    queue_email(_EVENT_BUILDERS[event_type](email, subject))
 
 if __name__ == "__main__":
     print("🚀 My Application with Gmail Integration")
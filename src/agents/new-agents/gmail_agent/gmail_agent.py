@@ -6,25 +6,32 @@ It uses the Gmail API with OAuth2 authentication and integrates with the ASI:One
 Make sure to set up your Google Cloud credentials and enable the Gmail API.
 """
 
-import base64
+import asyncio
+import binascii
+import functools
+import hashlib
 import os
 import re
 import threading
 import time
+from collections import deque
 from datetime import datetime
 from email.message import EmailMessage
 from enum import Enum
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 from uuid import uuid4
 
-import google.auth
+import httplib2
+import httpx
+import orjson
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from openai import OpenAI
+from openai import AsyncOpenAI
 from uagents import Agent, Context, Model, Protocol
-from uagents.experimental.quota import QuotaProtocol, RateLimit
+from uagents.experimental.quota import QuotaProtocol
 from uagents_core.models import ErrorMessage
 from uagents_core.contrib.protocols.chat import (
     AgentContent,
@@ -35,6 +42,15 @@ from uagents_core.contrib.protocols.chat import (
     chat_protocol_spec,
 )
 
+# Run the agent on uvloop when available. The Agent binds its event loop at
+# construction time, so it is handed a uvloop loop directly; installing uvloop
+# as the global policy would also change it for every script importing this module.
+try:
+    import uvloop
+    agent_loop = uvloop.new_event_loop()
+except ImportError:
+    agent_loop = None
+
 # Configuration
 AGENT_NAME = os.getenv("AGENT_NAME", "Gmail Agent")
 AGENT_SEED = os.getenv("AGENT_SEED", "your_seed_phrase_here")
@@ -60,10 +76,56 @@ OAUTH_SERVER_HOST = 'localhost'
 OAUTH_SERVER_PORT = 8080
 OAUTH_BASE_URL = f'http://{OAUTH_SERVER_HOST}:{OAUTH_SERVER_PORT}'
 
+# Gmail REST endpoints, called directly over httpx when sending
+GMAIL_API_BASE_URL = 'https://gmail.googleapis.com/gmail/v1/users/me'
+GMAIL_BATCH_URL = 'https://gmail.googleapis.com/batch/gmail/v1'
+GMAIL_BATCH_LIMIT = 100  # Most calls Gmail accepts in one batch request
+EMAIL_RATE_LIMIT_REQUESTS = 10  # Email requests allowed per sender...
+EMAIL_RATE_LIMIT_WINDOW = 60 * 60  # ...per this many seconds
+RECIPIENT_RATE_LIMIT_EMAILS = 20  # Emails allowed to any one recipient...
+RECIPIENT_RATE_LIMIT_WINDOW = 60 * 60  # ...per this many seconds
+GMAIL_DAILY_SEND_LIMIT = 500  # Emails the Gmail account sends per day, across all senders
+GMAIL_MAX_CONNECTIONS = 20  # Pooled connections to the Gmail API
+GMAIL_KEEPALIVE_EXPIRY = 600  # Seconds an idle pooled connection is kept open
+GMAIL_REQUEST_TIMEOUT = 10  # Seconds to wait on a Gmail API connect or read before giving up
+GMAIL_NUM_RETRIES = 2  # Retries for googleapiclient calls on 429/5xx responses
+MAX_CONVERSATION_MESSAGES = 20  # Chat history kept per sender (10 user + 10 assistant messages)
+CREDENTIALS_REFRESH_MARGIN = 300  # Seconds before expiry at which cached credentials are refreshed
+TOKEN_REFRESH_RETRY_DELAY = 60  # Seconds before the background refresher retries or checks for new credentials
+ASI_ONE_MAX_CONNECTIONS = 20  # Kept-alive connections to the ASI:One API
+INLINE_ENCODE_MAX_BODY = 512  # Longer email bodies are MIME-encoded in a worker thread
+TEMPLATE_CACHE_MAX_BODY = 2048  # Longer email bodies skip the MIME template cache
+DUPLICATE_SEND_WINDOW = 60  # Seconds an identical email is treated as a retry of the first
+
 # Global OAuth server instance
 oauth_server = None
 oauth_server_thread = None
 
+# Shared HTTP/2 client for Gmail API calls, opened on startup
+http_client: Optional[httpx.AsyncClient] = None
+
+# Cached OAuth credentials, and the authenticated user's address used as the
+# default sender; looked up once, then only again after re-authentication
+gmail_credentials: Optional[Credentials] = None
+default_from_email: Optional[str] = None
+
+gmail_credentials_lock = threading.Lock()
+
+# Serializes credential reloads and profile lookups so concurrent sends
+# share one fetch instead of each starting their own
+gmail_auth_lock = asyncio.Lock()
+
+# Background task that refreshes the cached token before it expires
+token_refresh_task: Optional[asyncio.Task] = None
+
+# Cached (credentials, service) for check_oauth_credentials and batch sends
+gmail_service_cache: Optional[tuple] = None
+gmail_service_lock = threading.Lock()
+
+# Recent sends by content digest: digest -> (started at, future of the send
+# result), oldest first. Retried requests share the original send's result.
+recent_sends: Dict[str, Tuple[float, asyncio.Future]] = {}
+
 # Initialize the agent
 agent = Agent(
     name=AGENT_NAME,
@@ -71,15 +133,25 @@ agent = Agent(
     port=PORT,
     mailbox=True,
     publish_agent_details=True,
+    loop=agent_loop,
 )
 
 # Initialize ASI:One client
 asi_one_client = None
 if ASI_ONE_API_KEY:
     try:
-        asi_one_client = OpenAI(
+        # Async client on a kept-alive HTTP/2 connection, so ASI:One calls
+        # neither block the event loop nor redo the TLS handshake each time
+        asi_one_client = AsyncOpenAI(
             base_url=ASI_ONE_BASE_URL,
             api_key=ASI_ONE_API_KEY,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(
+                    max_keepalive_connections=ASI_ONE_MAX_CONNECTIONS,
+                    keepalive_expiry=GMAIL_KEEPALIVE_EXPIRY
+                )
+            ),
         )
         print("✅ ASI:One client initialized successfully")
     except Exception as e:
@@ -105,6 +177,16 @@ class EmailStatusResponse(Model):
     success: bool = False
 
 
+class EmailBatchSendRequest(Model):
+    """Request to send several emails in as few Gmail API round-trips as possible"""
+    messages: List[EmailSendRequest]
+
+
+class EmailBatchStatusResponse(Model):
+    """Responses for a batch send, in the same order as the requested messages"""
+    results: List[EmailStatusResponse]
+
+
 class EmailStatus(str, Enum):
     """Email sending status"""
     SUCCESS = "success"
@@ -127,52 +209,86 @@ def start_oauth_server():
 
 
 def check_oauth_status():
-    """Check OAuth authentication status via web server"""
-    try:
-        import requests
-        response = requests.get(f'{OAUTH_BASE_URL}/status', timeout=5)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {'authenticated': False, 'error': 'Server not responding'}
-    except Exception as e:
-        return {'authenticated': False, 'error': str(e)}
+    """Check OAuth authentication status recorded by the in-process web server"""
+    if oauth_server is None:
+        return {'authenticated': False, 'email': None}
+    from web_oauth_server import get_status
+    if not os.path.exists(TOKEN_FILE):
+        # The recorded account no longer has a token behind it
+        forget_oauth_status()
+    return get_status()
+
+
+def forget_oauth_status():
+    """Clear the account recorded by the web server once its token is gone or rejected"""
+    if oauth_server is not None:
+        from web_oauth_server import set_authenticated_email
+        set_authenticated_email(None)
 
 
 # OAuth Authentication Functions
+def get_gmail_service(creds: Credentials):
+    """Return the Gmail API service for creds, building it only when the credentials object changes
+    
+    Credentials are refreshed in place, and the service sends whatever token
+    they currently hold, so token rotation alone doesn't need a rebuild.
+    """
+    global gmail_service_cache
+    
+    with gmail_service_lock:
+        if gmail_service_cache is None or gmail_service_cache[0] is not creds:
+            # Without an explicit Http the client waits on a stalled socket indefinitely
+            http = AuthorizedHttp(creds, http=httplib2.Http(timeout=GMAIL_REQUEST_TIMEOUT))
+            service = build('gmail', 'v1', http=http, cache_discovery=False, static_discovery=True)
+            gmail_service_cache = (creds, service)
+        return gmail_service_cache[1]
+
+
+def invalidate_gmail_service(error: Exception):
+    """Drop the cached service after an auth failure so the next call rebuilds it"""
+    global gmail_service_cache
+    
+    if isinstance(error, HttpError) and error.resp.status in (401, 403):
+        gmail_service_cache = None
+
+
 def check_oauth_credentials():
     """Check if OAuth credentials are available and valid"""
-    # First try web server status check
-    try:
-        status = check_oauth_status()
-        if status.get('authenticated'):
-            return True, f"Authenticated as: {status.get('email', 'Unknown')}"
-    except:
-        pass
+    global default_from_email
     
-    # Fallback to direct file check
     # Check if credentials file exists
     if not os.path.exists(CREDENTIALS_FILE):
         return False, "OAuth credentials file not found. Please contact administrator to set up OAuth."
     
     # Check if token file exists
     if not os.path.exists(TOKEN_FILE):
+        forget_oauth_status()
         return False, "OAuth token not found. Please authenticate using the provided link."
     
+    # Then try web server status check
+    try:
+        status = check_oauth_status()
+        if status.get('authenticated'):
+            return True, f"Authenticated as: {status.get('email', 'Unknown')}"
+    except:
+        pass
+    
     try:
-        # Load and validate credentials
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, OAUTH_SCOPES)
+        # Load (or reuse the cached) credentials, refreshing them if needed
+        creds = get_oauth_credentials()
         
-        # Refresh token if needed
-        if creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-            # Save refreshed token
-            with open(TOKEN_FILE, 'w') as token:
-                token.write(creds.to_json())
+        # Credentials that load and refresh are valid; only probe the Gmail
+        # API when we don't yet know which account they belong to
+        if default_from_email:
+            return True, f"Authenticated as: {default_from_email}"
         
-        # Test Gmail API access
-        service = build('gmail', 'v1', credentials=creds)
-        profile = service.users().getProfile(userId='me').execute()
+        service = get_gmail_service(creds)
+        try:
+            profile = service.users().getProfile(userId='me').execute(num_retries=GMAIL_NUM_RETRIES)
+        except HttpError as error:
+            invalidate_gmail_service(error)
+            raise
+        default_from_email = profile['emailAddress']
         
         return True, f"Authenticated as: {profile['emailAddress']}"
         
@@ -180,33 +296,439 @@ def check_oauth_credentials():
         return False, f"OAuth authentication failed: {str(e)}"
 
 
+def refresh_oauth_credentials(creds: Credentials) -> Credentials:
+    """Refresh OAuth credentials in place and save the new token"""
+    creds.refresh(Request())
+    # Save refreshed token
+    with open(TOKEN_FILE, 'w') as token:
+        token.write(creds.to_json())
+    return creds
+
+
+def credentials_fresh(creds: Optional[Credentials]) -> bool:
+    """Whether creds hold a token that won't expire within CREDENTIALS_REFRESH_MARGIN seconds"""
+    if creds is None or not creds.token:
+        return False
+    if creds.expiry is None:
+        return True
+    # google-auth keeps expiry as a naive UTC datetime
+    return (creds.expiry - datetime.utcnow()).total_seconds() > CREDENTIALS_REFRESH_MARGIN
+
+
 def get_oauth_credentials():
-    """Get valid OAuth credentials"""
+    """Get valid OAuth credentials, cached in-process until they near expiry"""
+    global gmail_credentials, default_from_email
+    
+    with gmail_credentials_lock:
+        if credentials_fresh(gmail_credentials):
+            return gmail_credentials
+        
+        try:
+            creds = gmail_credentials
+            if creds is not None and creds.refresh_token:
+                try:
+                    # Refresh in place instead of re-reading the token file
+                    refresh_oauth_credentials(creds)
+                except Exception:
+                    # The refresh token may have been revoked; fall back to the
+                    # token file, which may hold a newer authorization
+                    creds = None
+            
+            if not credentials_fresh(creds):
+                creds = Credentials.from_authorized_user_file(TOKEN_FILE, OAUTH_SCOPES)
+                # A newly loaded token may belong to a different account
+                default_from_email = None
+                
+                # Refresh token if needed
+                if not credentials_fresh(creds) and creds.refresh_token:
+                    refresh_oauth_credentials(creds)
+            
+            gmail_credentials = creds
+            return creds
+        except Exception as e:
+            raise Exception(f"Failed to load OAuth credentials: {str(e)}")
+
+
+class TokenBucketRateLimiter:
+    """Per-sender token bucket rate limiter
+    
+    Each sender's bucket is just two floats, [tokens, last update], kept in
+    agent storage so limits survive restarts. Buckets refill continuously, so
+    there is no window boundary to burst across. allow() never awaits, so no
+    lock is needed.
+    """
+    
+    def __init__(self, storage, max_requests: int, window_seconds: float, key_prefix: str = "rate_limit"):
+        self.storage = storage
+        self.capacity = max_requests
+        self.rate = max_requests / window_seconds  # Tokens regained per second
+        self.key_prefix = key_prefix
+    
+    def _tokens(self, key: str, now: float) -> float:
+        """Tokens in the bucket for key as of now"""
+        tokens, last = self.storage.get(key) or (self.capacity, now)
+        return min(self.capacity, tokens + max(0.0, now - last) * self.rate)
+    
+    def available(self, sender: str) -> bool:
+        """Whether allow() would let sender through, without taking a token"""
+        return self._tokens(f"{self.key_prefix}_{sender}", time.time()) >= 1
+    
+    def allow(self, sender: str) -> bool:
+        """Take a token for sender, returning False if they are over the limit"""
+        key = f"{self.key_prefix}_{sender}"
+        # Wall-clock time, since buckets outlive the process
+        now = time.time()
+        tokens = self._tokens(key, now)
+        allowed = tokens >= 1
+        self.storage.set(key, [tokens - 1 if allowed else tokens, now])
+        return allowed
+    
+    def refund(self, sender: str):
+        """Give back a token taken for a request that didn't go through"""
+        key = f"{self.key_prefix}_{sender}"
+        now = time.time()
+        self.storage.set(key, [min(self.capacity, self._tokens(key, now) + 1), now])
+
+
+class SlidingWindowRateLimiter:
+    """Sliding window log rate limiter
+    
+    Keeps the send times inside the window, at most max_requests floats per
+    key, in agent storage. Unlike a fixed window, a full quota can't be spent
+    twice by straddling a window boundary.
+    """
+    
+    def __init__(self, storage, max_requests: int, window_seconds: float, key_prefix: str):
+        self.storage = storage
+        self.capacity = max_requests
+        self.window_seconds = window_seconds
+        self.key_prefix = key_prefix
+    
+    def _window(self, storage_key: str, now: float) -> deque:
+        """Request times for storage_key still inside the window as of now"""
+        window = deque(self.storage.get(storage_key) or (), maxlen=self.capacity)
+        while window and now - window[0] >= self.window_seconds:
+            window.popleft()
+        return window
+    
+    def available(self, key: str) -> bool:
+        """Whether allow() would let key through, without recording anything"""
+        return len(self._window(f"{self.key_prefix}_{key}", time.time())) < self.capacity
+    
+    def allow(self, key: str) -> bool:
+        """Record a request for key, returning False (and recording nothing) if it is over the limit"""
+        storage_key = f"{self.key_prefix}_{key}"
+        window = self._window(storage_key, time.time())
+        if len(window) >= self.capacity:
+            return False
+        window.append(time.time())
+        self.storage.set(storage_key, list(window))
+        return True
+    
+    def refund(self, key: str):
+        """Drop the latest request recorded for key, for one that didn't go through"""
+        storage_key = f"{self.key_prefix}_{key}"
+        window = self._window(storage_key, time.time())
+        if window:
+            window.pop()
+            self.storage.set(storage_key, list(window))
+
+
+# Email sending protocol, rate limited per sender by email_rate_limiter
+proto = Protocol(name="Gmail-Sender-Protocol", version="0.1.0")
+email_rate_limiter = TokenBucketRateLimiter(agent.storage, EMAIL_RATE_LIMIT_REQUESTS, EMAIL_RATE_LIMIT_WINDOW)
+
+# Per-sender limits don't stop one runaway agent from flooding a recipient or
+# using up the account's Gmail quota for everyone, so sends are also limited
+# per recipient and for the account as a whole
+recipient_rate_limiter = SlidingWindowRateLimiter(
+    agent.storage, RECIPIENT_RATE_LIMIT_EMAILS, RECIPIENT_RATE_LIMIT_WINDOW, key_prefix="recipient_limit"
+)
+account_send_limiter = TokenBucketRateLimiter(
+    agent.storage, GMAIL_DAILY_SEND_LIMIT, 24 * 60 * 60, key_prefix="send_quota"
+)
+
+
+async def reject_if_rate_limited(ctx: Context, sender: str) -> bool:
+    """Reply with an error and return True if sender is over the email rate limit"""
+    if email_rate_limiter.allow(sender):
+        return False
+    ctx.logger.warning(f"Rate limit exceeded for {sender}")
+    await ctx.send(sender, ErrorMessage(
+        error=f"Rate limit exceeded: at most {EMAIL_RATE_LIMIT_REQUESTS} email requests per {EMAIL_RATE_LIMIT_WINDOW // 60} minutes. Please try again later."
+    ))
+    return True
+
+
+def reserve_send_quota(to_email: str) -> Optional[str]:
+    """Count an email against the recipient and account send limits
+    
+    Both limits are checked before either is charged, so an email refused by
+    one doesn't use up the other. Returns an error message, charging nothing,
+    if either limit is exhausted. Call refund_send_quota if the send then fails.
+    """
+    recipient = to_email.strip().lower()
+    if not recipient_rate_limiter.available(recipient):
+        return f"Rate limit exceeded: at most {RECIPIENT_RATE_LIMIT_EMAILS} emails to {to_email} per {RECIPIENT_RATE_LIMIT_WINDOW // 60} minutes. Please try again later."
+    if not account_send_limiter.available("account"):
+        return f"Daily Gmail send limit of {GMAIL_DAILY_SEND_LIMIT} emails reached. Please try again later."
+    recipient_rate_limiter.allow(recipient)
+    account_send_limiter.allow("account")
+    return None
+
+
+def refund_send_quota(to_email: str):
+    """Give back the quota reserved for an email that wasn't sent"""
+    recipient_rate_limiter.refund(to_email.strip().lower())
+    account_send_limiter.refund("account")
+
+
+def token_file_mtime() -> Optional[float]:
+    """Modification time of the token file, or None if there is none"""
     try:
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, OAUTH_SCOPES)
+        return os.path.getmtime(TOKEN_FILE)
+    except OSError:
+        return None
+
+
+async def refresh_credentials_in_background():
+    """Refresh the cached OAuth token ahead of expiry so sends never wait on it
+    
+    Sleeps until the token is CREDENTIALS_REFRESH_MARGIN seconds from expiry,
+    then goes through get_oauth_credentials, which leaves a still-fresh token
+    alone. A token that can't be refreshed is left until the token file
+    changes, e.g. after the user re-authenticates.
+    """
+    stale_token_mtime = None
+    while True:
+        creds = gmail_credentials
+        if stale_token_mtime is not None:
+            await asyncio.sleep(TOKEN_REFRESH_RETRY_DELAY)
+            if token_file_mtime() == stale_token_mtime:
+                continue
+            stale_token_mtime = None
+        elif creds is not None and creds.expiry is not None:
+            remaining = (creds.expiry - datetime.utcnow()).total_seconds()
+            await asyncio.sleep(max(1, remaining - CREDENTIALS_REFRESH_MARGIN))
+        elif creds is None and os.path.exists(TOKEN_FILE):
+            # Dropped after a 401, or not loaded yet; load the token file now
+            pass
+        else:
+            await asyncio.sleep(TOKEN_REFRESH_RETRY_DELAY)
+            continue
         
-        # Refresh token if needed
-        if creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-            # Save refreshed token
-            with open(TOKEN_FILE, 'w') as token:
-                token.write(creds.to_json())
+        try:
+            async with gmail_auth_lock:
+                creds = await asyncio.to_thread(get_oauth_credentials)
+        except Exception as e:
+            print(f"❌ Background token refresh failed: {e}")
+            await asyncio.sleep(TOKEN_REFRESH_RETRY_DELAY)
+            continue
         
-        return creds
-    except Exception as e:
-        raise Exception(f"Failed to load OAuth credentials: {str(e)}")
+        if not credentials_fresh(creds):
+            if not creds.refresh_token:
+                # Google omits the refresh token on some re-consents; retrying
+                # would only re-read the same file
+                print("⚠️ OAuth token has no refresh token and is about to expire; waiting for re-authentication")
+                stale_token_mtime = token_file_mtime()
+            else:
+                await asyncio.sleep(TOKEN_REFRESH_RETRY_DELAY)
 
 
-# Quota protocol for rate limiting
-proto = QuotaProtocol(
-    storage_reference=agent.storage,
-    name="Gmail-Sender-Protocol",
-    version="0.1.0",
-    default_rate_limit=RateLimit(window_size_minutes=60, max_requests=10),
-)
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, opening it if needed"""
+    global http_client
+    
+    if http_client is None or http_client.is_closed:
+        # HTTP/2 multiplexes concurrent sends over one kept-alive TLS connection
+        http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=GMAIL_REQUEST_TIMEOUT,
+            # httpx drops idle connections after 5s by default, which would
+            # mean a fresh TLS handshake for all but back-to-back sends
+            limits=httpx.Limits(
+                max_connections=GMAIL_MAX_CONNECTIONS,
+                max_keepalive_connections=GMAIL_MAX_CONNECTIONS,
+                keepalive_expiry=GMAIL_KEEPALIVE_EXPIRY
+            )
+        )
+    return http_client
+
+
+async def get_access_token() -> str:
+    """Return a valid Gmail access token, refreshing the cached credentials only when they near expiry"""
+    async with gmail_auth_lock:
+        creds = gmail_credentials
+        if not credentials_fresh(creds):
+            # Loading and refreshing use blocking I/O, so keep them off the event loop
+            creds = await asyncio.to_thread(get_oauth_credentials)
+        return creds.token
+
+
+async def get_self_email(token: str) -> str:
+    """Return the authenticated user's email address, looking it up only on first use"""
+    global default_from_email
+    
+    if default_from_email:
+        return default_from_email
+    
+    async with gmail_auth_lock:
+        # Another send may have fetched it while we waited for the lock
+        if default_from_email:
+            return default_from_email
+        
+        response = await get_http_client().get(
+            f"{GMAIL_API_BASE_URL}/profile",
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        if response.status_code != 200:
+            raise Exception(f"Gmail API error: {response.status_code} {response.text}")
+        profile = orjson.loads(response.content)
+        
+        default_from_email = profile["emailAddress"]
+        return default_from_email
 
 
-def send_gmail_message(to_email: str, subject: str, body: str, from_email: Optional[str] = None) -> dict:
+# Maps standard base64 output to the URL-safe alphabet Gmail expects
+_URLSAFE_B64_TABLE = bytes.maketrans(b'+/', b'-_')
+
+
+def urlsafe_b64encode(data: bytes) -> bytes:
+    """base64url-encode data in two C-level passes (encode, then translate)"""
+    return binascii.b2a_base64(data, newline=False).translate(_URLSAFE_B64_TABLE)
+
+
+def raw_message_json(encoded_message: bytes) -> bytes:
+    """JSON body {"raw": ...} for messages.send, built directly from the encoded bytes
+    
+    base64url output never needs JSON escaping, so there is nothing to serialize.
+    """
+    return b"".join((b'{"raw":"', encoded_message, b'"}'))
+
+
+@functools.lru_cache(maxsize=64)
+def encode_message_template(subject: str, body: str, from_email: str) -> bytes:
+    """MIME bytes of an email minus its To header, cached for repeated (templated) emails"""
+    message = EmailMessage()
+    message.set_content(body)
+    message["Subject"] = subject
+    message["From"] = from_email
+    return message.as_bytes()
+
+
+def build_raw_message(to_email: str, subject: str, body: str, from_email: str) -> bytes:
+    """Build an email and return it base64url-encoded, as the Gmail API expects
+    
+    The result stays bytes; callers decode it once, at the JSON boundary.
+    """
+    if to_email.isascii() and '\r' not in to_email and '\n' not in to_email:
+        # The recipient is the only per-send part; prepend it to the rest.
+        # Only short (templated) bodies are cached: one-off bodies would just
+        # pin up to 64 large messages in memory for no hits
+        if len(body) <= TEMPLATE_CACHE_MAX_BODY:
+            template = encode_message_template(subject, body, from_email)
+        else:
+            template = encode_message_template.__wrapped__(subject, body, from_email)
+        raw = b"".join((b"To: ", to_email.encode(), b"\n", template))
+        return urlsafe_b64encode(raw)
+    
+    # Non-ASCII or malformed recipients go through full header handling
+    message = EmailMessage()
+    message.set_content(body)
+    message["To"] = to_email
+    message["Subject"] = subject
+    message["From"] = from_email
+    return urlsafe_b64encode(message.as_bytes())
+
+
+def build_raw_messages(messages: List[EmailSendRequest], default_from: Optional[str]) -> List[bytes]:
+    """build_raw_message for each request, falling back to default_from as the sender"""
+    return [
+        build_raw_message(m.to, m.subject or "", m.body, m.from_email or default_from)
+        for m in messages
+    ]
+
+
+async def encode_off_loop(function, *args, body_size: int):
+    """Run an encoding function inline for short bodies, in a worker thread otherwise
+    
+    The email generator and base64 pass are pure CPU work; for large bodies they
+    would stall every other handler on the agent's event loop.
+    """
+    if body_size < INLINE_ENCODE_MAX_BODY:
+        return function(*args)
+    return await asyncio.to_thread(function, *args)
+
+
+def email_digest(to_email: str, subject: str, body: str, from_email: Optional[str]) -> str:
+    """Content hash identifying an outbound email, for duplicate detection"""
+    key = f"{to_email}\x00{subject}\x00{body}\x00{from_email or ''}"
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def recent_send(digest: str) -> Optional[asyncio.Future]:
+    """Return the result future of an identical send from the last DUPLICATE_SEND_WINDOW seconds, if any"""
+    entry = recent_sends.get(digest)
+    if entry and time.monotonic() - entry[0] < DUPLICATE_SEND_WINDOW:
+        return entry[1]
+    return None
+
+
+def remember_send(digest: str, result: asyncio.Future):
+    """Record a send so repeats within DUPLICATE_SEND_WINDOW reuse its result"""
+    now = time.monotonic()
+    # Entries are kept oldest first, so expired ones are all at the front
+    while recent_sends:
+        oldest = next(iter(recent_sends))
+        if now - recent_sends[oldest][0] < DUPLICATE_SEND_WINDOW:
+            break
+        del recent_sends[oldest]
+    recent_sends[digest] = (now, result)
+
+
+def start_send(digest: str) -> asyncio.Future:
+    """Register a send as in flight, so identical requests wait for its result instead of sending again"""
+    future = asyncio.get_running_loop().create_future()
+    remember_send(digest, future)
+    return future
+
+
+def settle_send(digest: str, future: asyncio.Future, outcome: dict):
+    """Hand a send's outcome to anyone waiting on it; failures are forgotten so they can be retried"""
+    future.set_result(outcome)
+    if not outcome["success"] and recent_sends.get(digest, (None, None))[1] is future:
+        recent_sends.pop(digest, None)
+
+
+# Outcome handed to requests waiting on a send that was cancelled
+SEND_CANCELLED_RESULT = {"success": False, "message_id": None, "error": "Send was cancelled"}
+
+
+async def send_gmail_message(to_email: str, subject: str, body: str, from_email: Optional[str] = None) -> dict:
+    """
+    Send an email, unless an identical one was sent moments ago
+    
+    Mailbox agents retry on timeout and users repeat themselves; a repeat of
+    the same recipient, subject, body and sender within DUPLICATE_SEND_WINDOW
+    seconds gets the first send's result instead of a second email.
+    """
+    digest = email_digest(to_email, subject, body, from_email)
+    previous = recent_send(digest)
+    if previous is not None:
+        return await asyncio.shield(previous)
+    
+    result = start_send(digest)
+    try:
+        outcome = await deliver_gmail_message(to_email, subject, body, from_email)
+    except asyncio.CancelledError:
+        # Let a later retry send it; anyone waiting on this send just fails
+        settle_send(digest, result, SEND_CANCELLED_RESULT)
+        raise
+    settle_send(digest, result, outcome)
+    return outcome
+
+
+async def deliver_gmail_message(to_email: str, subject: str, body: str, from_email: Optional[str] = None) -> dict:
     """
     Send an email using Gmail API with OAuth authentication
     
@@ -219,48 +741,48 @@ def send_gmail_message(to_email: str, subject: str, body: str, from_email: Optio
     Returns:
         dict: Response with status and message_id or error information
     """
+    global gmail_credentials, default_from_email
+    
     try:
         # Check OAuth credentials first
-        is_valid, message = check_oauth_credentials()
-        if not is_valid:
+        if not os.path.exists(TOKEN_FILE):
             return {
                 "success": False,
                 "message_id": None,
-                "error": f"Authentication required: {message}"
+                "error": "Authentication required: OAuth token not found. Please authenticate using the provided link."
             }
         
-        # Get OAuth credentials
-        creds = get_oauth_credentials()
-        
-        # Build Gmail service
-        service = build("gmail", "v1", credentials=creds)
-        
-        # Create email message
-        message = EmailMessage()
-        message.set_content(body)
-        message["To"] = to_email
-        message["Subject"] = subject
+        # Get OAuth access token
+        token = await get_access_token()
         
         # Get authenticated user's email if from_email not provided
         if not from_email:
-            profile = service.users().getProfile(userId="me").execute()
-            from_email = profile["emailAddress"]
-        
-        message["From"] = from_email
-        
-        # Encode message
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+            from_email = await get_self_email(token)
         
-        # Create message for sending
-        create_message = {"raw": encoded_message}
+        # Create and encode email message
+        encoded_message = await encode_off_loop(
+            build_raw_message, to_email, subject, body, from_email, body_size=len(body)
+        )
         
         # Send message
-        send_message = (
-            service.users()
-            .messages()
-            .send(userId="me", body=create_message)
-            .execute()
+        response = await get_http_client().post(
+            f"{GMAIL_API_BASE_URL}/messages/send",
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            content=raw_message_json(encoded_message)
         )
+        if response.status_code == 401:
+            # Token was revoked or rotated; reload credentials, and recheck
+            # which account they belong to, on the next send
+            gmail_credentials = None
+            default_from_email = None
+            forget_oauth_status()
+        if response.status_code != 200:
+            return {
+                "success": False,
+                "message_id": None,
+                "error": f"Gmail API error: {response.status_code} {response.text}"
+            }
+        send_message = orjson.loads(response.content)
         
         return {
             "success": True,
@@ -268,11 +790,12 @@ def send_gmail_message(to_email: str, subject: str, body: str, from_email: Optio
             "error": None
         }
         
-    except HttpError as error:
+    except httpx.TimeoutException:
         return {
             "success": False,
             "message_id": None,
-            "error": f"Gmail API error: {error}"
+            "error": f"Gmail API timed out after {GMAIL_REQUEST_TIMEOUT} seconds",
+            "status_code": 504
         }
     except Exception as error:
         return {
@@ -282,6 +805,160 @@ def send_gmail_message(to_email: str, subject: str, body: str, from_email: Optio
         }
 
 
+# Content-ID of a part in a Gmail batch response, e.g. <response-item3>
+_BATCH_CONTENT_ID_RE = re.compile(rb'^Content-ID:\s*<response-item(\d+)>', re.I | re.M)
+
+
+def build_batch_body(boundary: str, encoded_messages: List[bytes]) -> bytes:
+    """Build a multipart/mixed Gmail batch body with one messages.send call per encoded message"""
+    parts = []
+    for i, encoded_message in enumerate(encoded_messages):
+        parts.append(
+            f"--{boundary}\r\n"
+            f"Content-Type: application/http\r\n"
+            f"Content-ID: <item{i}>\r\n\r\n"
+            f"POST /gmail/v1/users/me/messages/send\r\n"
+            f"Content-Type: application/json\r\n\r\n".encode()
+        )
+        parts.append(raw_message_json(encoded_message))
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts)
+
+
+def parse_batch_response(content_type: str, content: bytes) -> Dict[int, Tuple[int, bytes]]:
+    """Split a multipart/mixed Gmail batch response into {item index: (status, body)}"""
+    if 'boundary=' not in content_type:
+        raise Exception(f"Batch response has no multipart boundary: {content_type!r}")
+    boundary = content_type.split('boundary=', 1)[1].split(';', 1)[0].strip().strip('"')
+    results = {}
+    for part in content.split(b"--" + boundary.encode()):
+        # Each part is its own headers, a blank line, then an embedded HTTP response
+        part_headers, _, http_response = part.strip().partition(b"\r\n\r\n")
+        match = _BATCH_CONTENT_ID_RE.search(part_headers)
+        if not match:
+            continue
+        status_line, _, rest = http_response.partition(b"\r\n")
+        _, _, body = rest.partition(b"\r\n\r\n")
+        results[int(match.group(1))] = (int(status_line.split()[1]), body)
+    return results
+
+
+def batch_error_result(error: Exception) -> dict:
+    """Result dict for a batch send that failed with error before Gmail answered"""
+    if isinstance(error, httpx.TimeoutException):
+        return {
+            "success": False,
+            "message_id": None,
+            "error": f"Gmail API timed out after {GMAIL_REQUEST_TIMEOUT} seconds",
+            "status_code": 504
+        }
+    return {
+        "success": False,
+        "message_id": None,
+        "error": f"Unexpected error: {error}"
+    }
+
+
+async def send_gmail_batch(messages: List[EmailSendRequest]) -> List[dict]:
+    """
+    Send several emails using Gmail batch HTTP requests
+    
+    Up to GMAIL_BATCH_LIMIT sends go out in a single multipart round-trip
+    on the shared HTTP client.
+    
+    Args:
+        messages: Email requests to send
+    
+    Returns:
+        list: One result dict per message, in order, shaped like send_gmail_message's
+    """
+    global gmail_credentials, default_from_email
+    
+    if not os.path.exists(TOKEN_FILE):
+        return [{
+            "success": False,
+            "message_id": None,
+            "error": "Authentication required: OAuth token not found. Please authenticate using the provided link."
+        }] * len(messages)
+    
+    try:
+        # Make sure the cached credentials are loaded and fresh
+        token = await get_access_token()
+        
+        # Only look up the sender address if some message needs it
+        default_from = None
+        if any(not m.from_email for m in messages):
+            default_from = await get_self_email(token)
+    except Exception as error:
+        return [batch_error_result(error)] * len(messages)
+    
+    results = []
+    for start in range(0, len(messages), GMAIL_BATCH_LIMIT):
+        chunk = messages[start:start + GMAIL_BATCH_LIMIT]
+        try:
+            encoded_messages = await encode_off_loop(
+                build_raw_messages, chunk, default_from, body_size=sum(len(m.body) for m in chunk)
+            )
+            boundary = f"batch_{uuid4().hex}"
+            response = await get_http_client().post(
+                GMAIL_BATCH_URL,
+                headers={
+                    "Authorization": f"Bearer {token}",
+                    "Content-Type": f"multipart/mixed; boundary={boundary}"
+                },
+                content=build_batch_body(boundary, encoded_messages)
+            )
+            
+            if response.status_code == 401:
+                # Token was revoked or rotated; reload credentials, and recheck
+                # which account they belong to, on the next send
+                gmail_credentials = None
+                default_from_email = None
+                forget_oauth_status()
+            if response.status_code != 200:
+                results.extend([{
+                    "success": False,
+                    "message_id": None,
+                    "error": f"Gmail API error: {response.status_code} {response.text}"
+                }] * len(chunk))
+                continue
+            
+            parts = parse_batch_response(response.headers.get("content-type", ""), response.content)
+        except Exception as error:
+            # Earlier chunks already went out and keep their results; only
+            # this chunk and the ones after it are reported as failed
+            results.extend([batch_error_result(error)] * (len(messages) - start))
+            break
+        
+        for i in range(len(chunk)):
+            status, body = parts.get(i, (None, b""))
+            if status == 200:
+                try:
+                    message_id = orjson.loads(body)["id"]
+                except (orjson.JSONDecodeError, TypeError, KeyError):
+                    # Gmail took the send but its reply can't be read
+                    results.append({
+                        "success": False,
+                        "message_id": None,
+                        "error": f"Unreadable Gmail API response: {body.decode('utf-8', 'replace')}"
+                    })
+                    continue
+                results.append({
+                    "success": True,
+                    "message_id": message_id,
+                    "error": None
+                })
+            else:
+                results.append({
+                    "success": False,
+                    "message_id": None,
+                    "error": f"Gmail API error: {status} {body.decode('utf-8', 'replace')}"
+                })
+    
+    return results
+
+
 @proto.on_message(EmailSendRequest, replies={EmailStatusResponse, ErrorMessage})
 async def handle_email_request(ctx: Context, sender: str, msg: EmailSendRequest):
     """
@@ -295,6 +972,9 @@ async def handle_email_request(ctx: Context, sender: str, msg: EmailSendRequest)
     ctx.logger.info(f"Received email request from {sender}")
     ctx.logger.info(f"To: {msg.to}, Subject: {msg.subject}")
     
+    if await reject_if_rate_limited(ctx, sender):
+        return
+    
     # Validate required fields
     missing_fields = []
     if not msg.to or not msg.to.strip():
@@ -319,13 +999,29 @@ async def handle_email_request(ctx: Context, sender: str, msg: EmailSendRequest)
         ctx.logger.info("No subject provided - sending email without subject")
         msg.subject = ""
     
+    # Repeats of a recent send aren't sent again, so only count new emails
+    quota_reserved = recent_send(email_digest(msg.to, msg.subject, msg.body, msg.from_email)) is None
+    if quota_reserved:
+        quota_error = reserve_send_quota(msg.to)
+        if quota_error:
+            ctx.logger.warning(f"Email request from {sender} rejected: {quota_error}")
+            await ctx.send(sender, EmailStatusResponse(
+                status_code=429,
+                error_message=quota_error,
+                success=False
+            ))
+            return
+    
     # Send the email
-    result = send_gmail_message(
+    result = await send_gmail_message(
         to_email=msg.to,
         subject=msg.subject,
         body=msg.body,
         from_email=msg.from_email
     )
+    if quota_reserved and not result["success"]:
+        # Nothing went out, so it shouldn't count against the send limits
+        refund_send_quota(msg.to)
     
     # Create response
     if result["success"]:
@@ -337,7 +1033,7 @@ async def handle_email_request(ctx: Context, sender: str, msg: EmailSendRequest)
         ctx.logger.info(f"Email sent successfully. Message ID: {result['message_id']}")
     else:
         response = EmailStatusResponse(
-            status_code=500,
+            status_code=result.get("status_code", 500),
             error_message=result["error"],
             success=False
         )
@@ -346,6 +1042,102 @@ async def handle_email_request(ctx: Context, sender: str, msg: EmailSendRequest)
     await ctx.send(sender, response)
 
 
+@proto.on_message(EmailBatchSendRequest, replies={EmailBatchStatusResponse, ErrorMessage})
+async def handle_email_batch_request(ctx: Context, sender: str, msg: EmailBatchSendRequest):
+    """
+    Handle batched email send requests
+    
+    Args:
+        ctx: Agent context
+        sender: Address of the requesting agent
+        msg: Batch of email send requests
+    """
+    ctx.logger.info(f"Received batch of {len(msg.messages)} email requests from {sender}")
+    
+    if await reject_if_rate_limited(ctx, sender):
+        return
+    
+    # Reject messages missing required fields up front; send the rest together
+    responses: List[Optional[EmailStatusResponse]] = [None] * len(msg.messages)
+    to_send = []
+    digests = {}
+    pending = {}
+    duplicates = []
+    for i, m in enumerate(msg.messages):
+        missing_fields = []
+        if not m.to or not m.to.strip():
+            missing_fields.append("recipient email address")
+        if not m.body or not m.body.strip():
+            missing_fields.append("message content")
+        if missing_fields:
+            responses[i] = EmailStatusResponse(
+                status_code=400,
+                error_message=f"Missing required fields: {', '.join(missing_fields)}",
+                success=False
+            )
+        else:
+            digests[i] = email_digest(m.to, m.subject or "", m.body, m.from_email)
+            previous = recent_send(digests[i])
+            if previous is not None:
+                # Repeat of a recent send; reuse its result instead of sending again
+                duplicates.append((i, previous))
+                continue
+            quota_error = reserve_send_quota(m.to)
+            if quota_error:
+                responses[i] = EmailStatusResponse(
+                    status_code=429,
+                    error_message=quota_error,
+                    success=False
+                )
+            else:
+                # Registered before sending, so a repeat later in this batch, or
+                # a single send arriving meanwhile, waits for this one instead
+                pending[i] = start_send(digests[i])
+                to_send.append(i)
+    
+    try:
+        results = await send_gmail_batch([msg.messages[i] for i in to_send]) if to_send else []
+    except BaseException as error:
+        # Requests waiting on these sends would otherwise block until the
+        # duplicate window expires, and the reserved quota would stay spent
+        if isinstance(error, asyncio.CancelledError):
+            outcome = SEND_CANCELLED_RESULT
+        else:
+            outcome = batch_error_result(error)
+        for i in to_send:
+            settle_send(digests[i], pending[i], outcome)
+            refund_send_quota(msg.messages[i].to)
+        raise
+    for i, result in zip(to_send, results):
+        settle_send(digests[i], pending[i], result)
+        if not result["success"]:
+            # Nothing went out, so it shouldn't count against the send limits
+            refund_send_quota(msg.messages[i].to)
+    
+    outcomes = list(zip(to_send, results))
+    for i, previous in duplicates:
+        outcomes.append((i, await asyncio.shield(previous)))
+    
+    for i, result in outcomes:
+        if result["success"]:
+            responses[i] = EmailStatusResponse(
+                status_code=200,
+                message_id=result["message_id"],
+                success=True
+            )
+        else:
+            responses[i] = EmailStatusResponse(
+                status_code=result.get("status_code", 500),
+                error_message=result["error"],
+                success=False
+            )
+    
+    sent = sum(1 for r in responses if r.success)
+    ctx.logger.info(f"Batch complete: {sent}/{len(responses)} emails sent")
+    
+    await ctx.send(sender, EmailBatchStatusResponse(results=responses))
+
+
 # Health check protocol
 class HealthCheck(Model):
     """Health check request"""
@@ -389,9 +1181,74 @@ async def handle_health_check(ctx: Context, sender: str, msg: HealthCheck):
 chat_protocol = Protocol(spec=chat_protocol_spec)
 
 
+# Fields ASI:One must return for every email request
+EMAIL_EXTRACT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "to": {"type": ["string", "null"]},
+        "subject": {"type": "string"},
+        "body": {"type": ["string", "null"]},
+        "is_valid": {"type": "boolean"},
+        "error": {"type": ["string", "null"]},
+        "reasoning": {"type": "string"},
+        "needs_clarification": {"type": "boolean"},
+        "suggestions": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["to", "subject", "body", "is_valid", "error", "reasoning", "needs_clarification", "suggestions"],
+    "additionalProperties": False
+}
+
+EMAIL_EXTRACT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "EmailExtract", "strict": True, "schema": EMAIL_EXTRACT_SCHEMA}
+}
+
+EMAIL_EXTRACT_SYSTEM_PROMPT = """You are a Gmail assistant. Extract an email (to, subject, body) from the user's request and reply with JSON matching the EmailExtract schema.
+
+Rules:
+- Use the conversation history to resolve references ("him", "same person", "the project") and reuse recipients or topics from earlier turns.
+- to: an email address from the text or history. If only a name or role is given, set to null and ask for their address.
+- subject: use an explicit subject, otherwise write a short one from the context.
+- body: write a complete, ready-to-send email with a greeting and closing in the user's tone. Never leave placeholders; if essential details (such as the sender's name) are missing, ask for them instead.
+- is_valid: true only when to and body are complete and the email can be sent as is.
+- When something is missing, set needs_clarification to true, explain in error, and list what to provide in suggestions.
+- reasoning: one sentence on what you understood."""
 
 
-def process_email_request_with_asi_one(text: str, conversation_history: list = None) -> dict:
+def extract_json_object(text: str) -> Optional[str]:
+    """Return the first complete top-level {...} object in text, or None
+    
+    One forward scan tracking brace depth, skipping braces inside JSON
+    strings, so nested objects and trailing prose are handled correctly.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+async def process_email_request_with_asi_one(text: str, conversation_history: list = None) -> dict:
     """
     Process natural language email requests using ASI:One LLM with intelligent reasoning
     
@@ -412,91 +1269,8 @@ def process_email_request_with_asi_one(text: str, conversation_history: list = N
         }
     
     try:
-        # Enhanced system prompt with intelligent reasoning and conversation context
-        system_prompt = """You are an intelligent Gmail assistant with advanced reasoning capabilities. Your task is to understand user intent and extract email information from ANY natural language input.
-
-CONVERSATION CONTEXT:
-- You have access to the full conversation history with this user
-- Use previous messages to understand context, references, and ongoing conversations
-- Remember information shared earlier (names, email addresses, preferences, etc.)
-- Build upon previous interactions to provide better assistance
-- If the user refers to "him", "her", "it", "that", etc., use conversation history to understand what they mean
-
-CAPABILITIES:
-- Understand conversational, casual, formal, or incomplete language
-- Infer missing information from context
-- Handle ambiguous requests intelligently
-- Use common sense and chat history to fill in details already discussed in previous turns
-- Suggest reasonable defaults when information is missing
-- Understand various ways people express email requests
-
-INTELLIGENT EXTRACTION RULES:
-1. RECIPIENT (to):
-   - Look for email addresses anywhere in the text
-   - If no email is found but a name/role is mentioned, ask for their email
-   - Accept partial emails and suggest completion
-   - Handle phrasing like “send to John” by asking for John’s email
-   - If a recipient was clearly mentioned in a previous turn, reuse it
-
-2. SUBJECT (subject):
-   - Extract explicit subjects (e.g., “subject: Meeting”)
-   - Infer subjects from context (“meeting tomorrow” → “Meeting Tomorrow”)
-   - Generate a clear and relevant subject when missing
-   - Maintain consistency with previous context if the topic is ongoing
-   - Use a conversational tone when appropriate
-
-3. CONTENT (body):
-   - Extract or compose the main message content
-   - Expand brief or incomplete inputs into full, natural-sounding emails
-   - Always ensure the message is complete — no placeholders or “fill-in-the-blank” text
-   - If essential information is missing (e.g., the sender’s name or key details), ask for it directly before finalizing
-   - Add polite greetings and closings, maintaining the user’s intended tone and style
-
-4. REASONING:
-   - Use chat history and context to maintain continuity
-   - Apply common sense when interpreting ambiguous inputs
-   - If a request is unclear, ask clarifying questions
-   - If information is missing, suggest what’s needed
-   - If a request seems incomplete, offer to help complete it
-   - Always be helpful, conversational, and context-aware
-
-EXAMPLES OF FLEXIBLE INPUTS YOU CAN HANDLE:
-- “email John about the meeting” → Ask for John’s email, suggest a subject
-- “send something to team@company.com” → Ask what to send
-- “write to Sarah” → Ask for Sarah’s email and what to write
-- “meeting tomorrow 2pm” → Ask who to send to, suggest subject/body
-- “tell the client we’re done” → Ask for client email, suggest professional message
-- "quick note to boss" → Ask for boss email, suggest brief professional note
-- If the user says "same person as before" or "same topic," reuse prior fields intelligently
-
-CONVERSATION CONTEXT EXAMPLES:
-- If user previously said "john@company.com" and now says "email him about the meeting" → Use john@company.com
-- If user mentioned "the project" earlier and now says "update the team" → Reference the project context
-- If user said "sarah is my manager" and now says "tell her we're done" → Use sarah's context
-- Build upon previous email requests and clarifications
-
-RESPONSE FORMAT:
-Always respond in this JSON format:
-{
-    "to": "email@example.com or null if missing",
-    "subject": "extracted or suggested subject",
-    "body": "extracted or suggested complete message content",
-    "is_valid": true/false,
-    "error": null or "helpful error message",
-    "reasoning": "brief explanation of what you understood and any suggestions",
-    "needs_clarification": true/false,
-    "suggestions": ["list of suggestions if clarification needed"]
-}
-
-BEHAVIOR SUMMARY:
-- Use common sense and past context from chat history
-- Never return incomplete messages
-- Always produce ready-to-send, natural emails
-- If any critical info is missing (like the recipient’s email or the sender’s name), ask clearly instead of leaving blanks
-- Keep tone adaptive, polite, and consistent with the user’s intent"""
-
         # Build messages array with conversation history
-        messages = [{"role": "system", "content": system_prompt}]
+        messages = [{"role": "system", "content": EMAIL_EXTRACT_SYSTEM_PROMPT}]
         
         # Add conversation history if provided
         if conversation_history:
@@ -506,61 +1280,60 @@ BEHAVIOR SUMMARY:
         messages.append({"role": "user", "content": text})
         
         # Query ASI:One with conversation context
-        response = asi_one_client.chat.completions.create(
+        response = await asi_one_client.chat.completions.create(
             model="asi1-mini",
             messages=messages,
-            max_tokens=1500,  # Increased for more detailed reasoning
-            temperature=0.3   # Higher temperature for more creative responses
+            max_tokens=600,  # Schema-constrained JSON; room for one full email body
+            temperature=0.3,
+            response_format=EMAIL_EXTRACT_RESPONSE_FORMAT
         )
         
         # Parse the response
         response_text = response.choices[0].message.content.strip()
         
-        # Try to extract JSON from response
-        import json
+        # The response is constrained to EMAIL_EXTRACT_SCHEMA, so it parses as a whole
         try:
-            # Look for JSON in the response
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            if json_start != -1 and json_end > json_start:
-                json_str = response_text[json_start:json_end]
-                result = json.loads(json_str)
-                
-                # Enhanced response handling with reasoning
-                if result.get("is_valid", False):
-                    return {
-                        "to": result.get("to"),
-                        "subject": result.get("subject", ""),
-                        "body": result.get("body"),
-                        "error": None,
-                        "is_valid_format": True,
-                        "reasoning": result.get("reasoning", ""),
-                        "needs_clarification": result.get("needs_clarification", False),
-                        "suggestions": result.get("suggestions", [])
-                    }
-                else:
-                    # Handle cases where ASI:One needs clarification
-                    if result.get("needs_clarification", False):
-                        suggestions = result.get("suggestions", [])
-                        suggestion_text = "\n".join([f"- {s}" for s in suggestions]) if suggestions else ""
-                        error_msg = f"{result.get('error', 'Need more information')}\n\nSuggestions:\n{suggestion_text}"
-                    else:
-                        error_msg = result.get("error", "Invalid email request")
-                    
-                    return {
-                        "to": result.get("to"),
-                        "subject": result.get("subject", ""),
-                        "body": result.get("body"),
-                        "error": error_msg,
-                        "is_valid_format": False,
-                        "reasoning": result.get("reasoning", ""),
-                        "needs_clarification": result.get("needs_clarification", False),
-                        "suggestions": result.get("suggestions", [])
-                    }
+            try:
+                result = orjson.loads(response_text)
+            except orjson.JSONDecodeError:
+                # Some replies still wrap the JSON in prose or a code fence
+                json_str = extract_json_object(response_text)
+                if json_str is None:
+                    raise
+                result = orjson.loads(json_str)
+            
+            # Enhanced response handling with reasoning
+            if result.get("is_valid", False):
+                return {
+                    "to": result.get("to"),
+                    "subject": result.get("subject", ""),
+                    "body": result.get("body"),
+                    "error": None,
+                    "is_valid_format": True,
+                    "reasoning": result.get("reasoning", ""),
+                    "needs_clarification": result.get("needs_clarification", False),
+                    "suggestions": result.get("suggestions", [])
+                }
             else:
-                raise ValueError("No JSON found in response")
+                # Handle cases where ASI:One needs clarification
+                if result.get("needs_clarification", False):
+                    suggestions = result.get("suggestions", [])
+                    suggestion_text = "\n".join([f"- {s}" for s in suggestions]) if suggestions else ""
+                    error_msg = f"{result.get('error', 'Need more information')}\n\nSuggestions:\n{suggestion_text}"
+                else:
+                    error_msg = result.get("error", "Invalid email request")
                 
-        except (json.JSONDecodeError, ValueError) as e:
+                return {
+                    "to": result.get("to"),
+                    "subject": result.get("subject", ""),
+                    "body": result.get("body"),
+                    "error": error_msg,
+                    "is_valid_format": False,
+                    "reasoning": result.get("reasoning", ""),
+                    "needs_clarification": result.get("needs_clarification", False),
+                    "suggestions": result.get("suggestions", [])
+                }
+        except (orjson.JSONDecodeError, AttributeError) as e:
             # Enhanced fallback with intelligent parsing
             return intelligent_fallback_parsing(text, response_text, str(e))
             
@@ -574,6 +1347,25 @@ BEHAVIOR SUMMARY:
         }
 
 
+# All intelligent_fallback_parsing patterns as one alternation, so the text is
+# scanned once. Apart from the email address each alternative is a lookahead:
+# it matches without consuming text, so one hint can't hide another that
+# overlaps it.
+_FALLBACK_RE = re.compile(
+    r'(?P<email>\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b)'
+    r'|(?=\b(?:send|email|write)\s+to\s+(?P<send_to>\w+))'
+    r'|(?=(?P<role>\b(?:john|jane|sarah|mike|team|boss|client|manager)\b))'
+    r'|(?=\b(?:the\s+)?(?P<named>\w+)\s+(?:about|regarding))'
+    r'|(?=\b(?:about|regarding|re:?)\s+(?P<about>.+))'
+    r'|(?=\b(?:subject|title):\s*(?P<titled>.+))'
+    r'|(?=(?P<topic>\b(?:meeting|project|update|proposal|invoice)\b))',
+    re.IGNORECASE
+)
+# Hint groups in priority order; the first group that matched anywhere wins
+_FALLBACK_RECIPIENT_GROUPS = ('send_to', 'role', 'named')
+_FALLBACK_SUBJECT_GROUPS = ('about', 'titled', 'topic')
+
+
 def intelligent_fallback_parsing(original_text: str, response_text: str, error: str) -> dict:
     """
     Intelligent fallback parsing when ASI:One response parsing fails
@@ -586,45 +1378,28 @@ def intelligent_fallback_parsing(original_text: str, response_text: str, error:
     Returns:
         dict: Parsed email information with helpful suggestions
     """
-    import re
+    # Leftmost match of each kind of hint, from a single scan of the text
+    first_matches = {}
+    for match in _FALLBACK_RE.finditer(original_text):
+        if match.lastgroup not in first_matches:
+            first_matches[match.lastgroup] = match.group(match.lastgroup)
     
-    # Try to extract email address from original text
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    email_match = re.search(email_pattern, original_text)
-    
-    # Try to extract names or roles
-    name_patterns = [
-        r'\b(?:send|email|write)\s+to\s+(\w+)',
-        r'\b(?:john|jane|sarah|mike|team|boss|client|manager)\b',
-        r'\b(?:the\s+)?(\w+)\s+(?:about|regarding)',
-    ]
+    # Email address, as written
+    email_address = first_matches.get('email')
     
-    potential_recipient = None
-    for pattern in name_patterns:
-        match = re.search(pattern, original_text.lower())
-        if match:
-            potential_recipient = match.group(1) if match.groups() else match.group(0)
-            break
-    
-    # Try to extract subject hints
-    subject_hints = []
-    subject_patterns = [
-        r'\b(?:about|regarding|re:?)\s+(.+)',
-        r'\b(?:subject|title):\s*(.+)',
-        r'\b(?:meeting|project|update|proposal|invoice)\b',
-    ]
-    
-    for pattern in subject_patterns:
-        match = re.search(pattern, original_text.lower())
-        if match:
-            subject_hints.append(match.group(1) if match.groups() else match.group(0))
+    # Names or roles, and subject hints, lowercased
+    potential_recipient = next(
+        (first_matches[group].lower() for group in _FALLBACK_RECIPIENT_GROUPS if group in first_matches),
+        None
+    )
+    subject_hints = [first_matches[group].lower() for group in _FALLBACK_SUBJECT_GROUPS if group in first_matches]
     
     # Generate helpful suggestions
     suggestions = []
     
-    if not email_match and not potential_recipient:
+    if not email_address and not potential_recipient:
         suggestions.append("Please specify who to send the email to (e.g., 'john@example.com' or 'send to john')")
-    elif not email_match and potential_recipient:
+    elif not email_address and potential_recipient:
         suggestions.append(f"I found '{potential_recipient}' but need their email address")
     
     if not subject_hints:
@@ -640,7 +1415,7 @@ def intelligent_fallback_parsing(original_text: str, response_text: str, error:
         error_msg = f"Could not parse your request. Please try rephrasing or use the structured format."
     
     return {
-        "to": email_match.group(0) if email_match else None,
+        "to": email_address,
         "subject": subject_hints[0] if subject_hints else "",
         "body": "",
         "error": error_msg,
@@ -654,6 +1429,24 @@ def intelligent_fallback_parsing(original_text: str, response_text: str, error:
 # Structured format extraction removed - now using AI-only parsing
 
 
+def save_conversation_turn(ctx: Context, sender: str, conversation_history: list, text: str, response_text: str):
+    """Append a user/assistant exchange to the sender's stored history
+    
+    Only the last MAX_CONVERSATION_MESSAGES are kept, which also bounds the
+    context sent to ASI:One on the next turn.
+    """
+    conversation_history.append({"role": "user", "content": text})
+    conversation_history.append({"role": "assistant", "content": response_text})
+    del conversation_history[:-MAX_CONVERSATION_MESSAGES]
+    
+    # Store updated conversation history
+    try:
+        ctx.storage.set(f"conversation_{sender}", conversation_history)
+        ctx.logger.info(f"Stored conversation history for {sender}: {len(conversation_history)} messages")
+    except Exception as e:
+        ctx.logger.warning(f"Failed to store conversation history for {sender}: {e}")
+
+
 @chat_protocol.on_message(ChatMessage)
 async def handle_chat_message(ctx: Context, sender: str, msg: ChatMessage):
     """
@@ -689,8 +1482,9 @@ async def handle_chat_message(ctx: Context, sender: str, msg: ChatMessage):
         ctx.logger.warning(f"Failed to retrieve conversation history for {sender}: {e}")
         conversation_history = []
     
-    # Check OAuth authentication status
-    is_authenticated, auth_message = check_oauth_credentials()
+    # Check OAuth authentication status (blocking file and network I/O, so
+    # run it in a worker thread to keep other handlers responsive)
+    is_authenticated, auth_message = await asyncio.to_thread(check_oauth_credentials)
     
     # Check if this is an empty or very short message (likely initialization)
     if not text or len(text.strip()) < 3:
@@ -740,19 +1534,7 @@ After authentication, you can send emails normally!
 What would you like to send today?"""
         
         # Update conversation history for greeting responses
-        conversation_history.append({"role": "user", "content": text})
-        conversation_history.append({"role": "assistant", "content": response_text})
-        
-        # Keep only last 10 messages to prevent context from growing too large
-        if len(conversation_history) > 20:  # 10 user + 10 assistant messages
-            conversation_history = conversation_history[-20:]
-        
-        # Store updated conversation history
-        try:
-            ctx.storage.set(conversation_key, conversation_history)
-            ctx.logger.info(f"Stored conversation history for {sender}: {len(conversation_history)} messages")
-        except Exception as e:
-            ctx.logger.warning(f"Failed to store conversation history for {sender}: {e}")
+        save_conversation_turn(ctx, sender, conversation_history, text, response_text)
         
         await ctx.send(sender, ChatMessage(
             timestamp=datetime.utcnow(),
@@ -765,7 +1547,7 @@ What would you like to send today?"""
     
     # Use ASI:One for intelligent natural language processing with conversation context
     if asi_one_client:
-        email_info = process_email_request_with_asi_one(text, conversation_history)
+        email_info = await process_email_request_with_asi_one(text, conversation_history)
         ctx.logger.info(f"ASI:One processing result: {email_info}")
     else:
         # If ASI:One is not available, provide helpful guidance
@@ -843,19 +1625,7 @@ After authentication, you can send emails using natural language.
 **💡 Tip:** Be as specific or casual as you want - I can understand both! Just talk to me naturally!"""
         
         # Update conversation history for error responses
-        conversation_history.append({"role": "user", "content": text})
-        conversation_history.append({"role": "assistant", "content": response_text})
-        
-        # Keep only last 10 messages to prevent context from growing too large
-        if len(conversation_history) > 20:  # 10 user + 10 assistant messages
-            conversation_history = conversation_history[-20:]
-        
-        # Store updated conversation history
-        try:
-            ctx.storage.set(conversation_key, conversation_history)
-            ctx.logger.info(f"Stored conversation history for {sender}: {len(conversation_history)} messages")
-        except Exception as e:
-            ctx.logger.warning(f"Failed to store conversation history for {sender}: {e}")
+        save_conversation_turn(ctx, sender, conversation_history, text, response_text)
         
         await ctx.send(sender, ChatMessage(
             timestamp=datetime.utcnow(),
@@ -874,7 +1644,7 @@ After authentication, you can send emails using natural language.
         subject_warning = "\nℹ️ Note: No subject was provided, so the email will be sent without a subject."
     
     # Send the email
-    result = send_gmail_message(
+    result = await send_gmail_message(
         to_email=email_info["to"],
         subject=email_info["subject"],
         body=email_info["body"]
@@ -891,19 +1661,7 @@ After authentication, you can send emails using natural language.
         response_text = f"❌ Failed to send email: {result['error']}"
     
     # Update conversation history
-    conversation_history.append({"role": "user", "content": text})
-    conversation_history.append({"role": "assistant", "content": response_text})
-    
-    # Keep only last 10 messages to prevent context from growing too large
-    if len(conversation_history) > 20:  # 10 user + 10 assistant messages
-        conversation_history = conversation_history[-20:]
-    
-    # Store updated conversation history
-    try:
-        ctx.storage.set(conversation_key, conversation_history)
-        ctx.logger.info(f"Stored conversation history for {sender}: {len(conversation_history)} messages")
-    except Exception as e:
-        ctx.logger.warning(f"Failed to store conversation history for {sender}: {e}")
+    save_conversation_turn(ctx, sender, conversation_history, text, response_text)
     
     # Send response back
     await ctx.send(sender, ChatMessage(
@@ -930,8 +1688,13 @@ agent.include(chat_protocol, publish_manifest=True)
 @agent.on_event("startup")
 async def startup(ctx: Context):
     """Agent startup event"""
+    global token_refresh_task
+    
     ctx.logger.info(f"Gmail Agent started: {agent.address}")
     
+    # Open the shared HTTP client used for Gmail API calls
+    get_http_client()
+    
     # Start OAuth server for web-based authentication
     if start_oauth_server():
         ctx.logger.info(f"🔐 OAuth server started at {OAUTH_BASE_URL}")
@@ -939,8 +1702,9 @@ async def startup(ctx: Context):
     else:
         ctx.logger.warning("❌ Failed to start OAuth server - authentication links will not work")
     
-    # Check OAuth authentication status
-    is_authenticated, auth_message = check_oauth_credentials()
+    # Check OAuth authentication status (blocking file and network I/O, so
+    # run it in a worker thread to keep other handlers responsive)
+    is_authenticated, auth_message = await asyncio.to_thread(check_oauth_credentials)
     
     if is_authenticated:
         ctx.logger.info(f"✅ OAuth authentication successful: {auth_message}")
@@ -949,6 +1713,9 @@ async def startup(ctx: Context):
         ctx.logger.warning(f"❌ OAuth authentication required: {auth_message}")
         ctx.logger.warning("Users will be prompted to authenticate before sending emails")
     
+    # Keep the access token refreshed off the send path
+    token_refresh_task = asyncio.create_task(refresh_credentials_in_background())
+    
     ctx.logger.info("Chat protocol enabled for natural language email requests")
     if asi_one_client:
         ctx.logger.info("✅ ASI:One AI integration enabled - all email parsing handled by AI")
@@ -958,6 +1725,17 @@ async def startup(ctx: Context):
         ctx.logger.warning("⚠️ Set ASI_ONE_API_KEY environment variable to enable email functionality")
 
 
+@agent.on_event("shutdown")
+async def shutdown(ctx: Context):
+    """Agent shutdown event"""
+    if token_refresh_task is not None:
+        token_refresh_task.cancel()
+    if http_client is not None and not http_client.is_closed:
+        await http_client.aclose()
+    if asi_one_client:
+        await asi_one_client.close()
+
+
 if __name__ == "__main__":
     print(f"Gmail Agent Address: {agent.address}")
     
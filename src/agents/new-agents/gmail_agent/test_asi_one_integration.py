@@ -6,6 +6,7 @@ This script demonstrates how the Gmail Agent processes natural language
 email requests using ASI:One LLM.
 """
 
+import asyncio
 import os
 import sys
 from datetime import datetime
@@ -18,7 +19,7 @@ from gmail_agent import process_email_request_with_asi_one, asi_one_client
 from uagents_core.contrib.protocols.chat import ChatMessage, TextContent
 
 
-def test_asi_one_processing():
+async def test_asi_one_processing():
     """Test ASI:One natural language processing"""
     
     print("🧪 Testing ASI:One Integration with Gmail Agent")
@@ -117,7 +118,7 @@ def test_asi_one_processing():
                 {"role": "user", "content": "Hi, I need to send some emails"},
                 {"role": "assistant", "content": "Hello! I'm your Gmail assistant. I can help you send emails using natural language. Just tell me what you want to send!"}
             ])
-            result = process_email_request_with_asi_one(test_case['input'], conversation_history)
+            result = await process_email_request_with_asi_one(test_case['input'], conversation_history)
             
             if result["is_valid_format"]:
                 print("✅ Processing successful")
@@ -170,7 +171,7 @@ def test_asi_one_processing():
         return False
 
 
-def test_chat_message_processing():
+async def test_chat_message_processing():
     """Test chat message processing with ASI:One"""
     
     print("\n🧪 Testing Chat Message Processing")
@@ -201,7 +202,7 @@ def test_chat_message_processing():
     print(f"Extracted text: {text}")
     
     # Process with ASI:One
-    result = process_email_request_with_asi_one(text)
+    result = await process_email_request_with_asi_one(text)
     
     if result["is_valid_format"]:
         print("✅ Chat message processing successful")
@@ -214,17 +215,17 @@ def test_chat_message_processing():
         return False
 
 
-def main():
+async def main():
     """Main test function"""
     
     print("Gmail Agent ASI:One Integration Test")
     print("=" * 50)
     
     # Test ASI:One processing
-    processing_success = test_asi_one_processing()
+    processing_success = await test_asi_one_processing()
     
     # Test chat message processing
-    chat_success = test_chat_message_processing()
+    chat_success = await test_chat_message_processing()
     
     print("\n" + "=" * 50)
     print("Overall Test Results:")
@@ -249,4 +250,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
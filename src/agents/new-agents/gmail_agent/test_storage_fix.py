@@ -6,6 +6,7 @@ This script tests the conversation history storage functionality
 to ensure the KeyValueStore.get() issue is resolved.
 """
 
+import asyncio
 import os
 import sys
 from datetime import datetime
@@ -17,7 +18,7 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from gmail_agent import process_email_request_with_asi_one
 
 
-def test_storage_fix():
+async def test_storage_fix():
     """Test that the storage fix works correctly"""
     
     print("🧪 Testing Storage Fix for Conversation History")
@@ -56,7 +57,7 @@ def test_storage_fix():
         print(f"History length: {len(test_case['history'])}")
         
         try:
-            result = process_email_request_with_asi_one(test_case['input'], test_case['history'])
+            result = await process_email_request_with_asi_one(test_case['input'], test_case['history'])
             
             if result:
                 print("✅ Function executed successfully")
@@ -86,14 +87,14 @@ def test_storage_fix():
         return False
 
 
-def main():
+async def main():
     """Main test function"""
     
     print("Gmail Agent Storage Fix Test")
     print("=" * 50)
     
     # Test the storage fix
-    storage_success = test_storage_fix()
+    storage_success = await test_storage_fix()
     
     print("\n" + "=" * 50)
     print("Storage Fix Test Results:")
@@ -112,4 +113,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
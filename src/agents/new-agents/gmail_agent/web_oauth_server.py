@@ -37,6 +37,9 @@ BASE_URL = f'http://{SERVER_HOST}:{SERVER_PORT}'
 # Store pending authentications
 pending_auths = {}
 
+# Email of the account last authenticated through this server, read in-process by get_status()
+authenticated_email = None
+
 
 class OAuthHandler(BaseHTTPRequestHandler):
     """HTTP handler for OAuth callback"""
@@ -199,9 +202,10 @@ class OAuthHandler(BaseHTTPRequestHandler):
                 token_file.write(credentials.to_json())
             
             # Test Gmail access
-            service = build('gmail', 'v1', credentials=credentials)
+            service = build('gmail', 'v1', credentials=credentials, cache_discovery=False, static_discovery=True)
             profile = service.users().getProfile(userId='me').execute()
             email_address = profile['emailAddress']
+            set_authenticated_email(email_address)
             
             # Clean up pending auth
             del pending_auths[auth_id]
@@ -210,6 +214,8 @@ class OAuthHandler(BaseHTTPRequestHandler):
             self.redirect_with_success(f"Successfully authenticated as {email_address}")
             
         except Exception as e:
+            # The token file may already hold the unverified new token
+            set_authenticated_email(None)
             self.redirect_with_error(f"Authentication failed: {str(e)}")
     
     def handle_status_check(self, query_params):
@@ -225,14 +231,17 @@ class OAuthHandler(BaseHTTPRequestHandler):
                         token_file.write(creds.to_json())
                 
                 # Test Gmail access
-                service = build('gmail', 'v1', credentials=creds)
+                service = build('gmail', 'v1', credentials=creds, cache_discovery=False, static_discovery=True)
                 profile = service.users().getProfile(userId='me').execute()
                 
+                set_authenticated_email(profile['emailAddress'])
+                
                 response = {
                     'authenticated': True,
                     'email': profile['emailAddress']
                 }
             else:
+                set_authenticated_email(None)
                 response = {
                     'authenticated': False,
                     'email': None
@@ -244,6 +253,8 @@ class OAuthHandler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps(response).encode())
             
         except Exception as e:
+            # The token is missing, revoked or can't reach Gmail
+            set_authenticated_email(None)
             response = {
                 'authenticated': False,
                 'error': str(e)
@@ -270,6 +281,20 @@ class OAuthHandler(BaseHTTPRequestHandler):
         pass
 
 
+def set_authenticated_email(email_address):
+    """Record the account the server has verified a token for"""
+    global authenticated_email
+    authenticated_email = email_address
+
+
+def get_status():
+    """Return the authentication status recorded by this server, without any network calls"""
+    return {
+        'authenticated': authenticated_email is not None,
+        'email': authenticated_email
+    }
+
+
 def start_oauth_server():
     """Start the OAuth server"""
     try:
@@ -0,0 +1,85 @@
+"""
+Gmail Batch Tests
+
+Unit tests for building and parsing the multipart bodies of Gmail batch sends.
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+for dependency in ("httpx", "orjson", "uagents", "googleapiclient", "google_auth_httplib2"):
+    pytest.importorskip(dependency)
+
+GMAIL_AGENT_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "src", "agents", "new-agents", "gmail_agent", "gmail_agent.py"
+)
+
+
+@pytest.fixture(scope="module")
+def gmail_agent():
+    """Load gmail_agent.py from its hyphenated directory"""
+    spec = importlib.util.spec_from_file_location("gmail_agent", GMAIL_AGENT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def batch_response(boundary: str, parts: list) -> bytes:
+    """Build a Gmail-style batch response from (headers, status line, body) parts"""
+    content = b""
+    for headers, status_line, body in parts:
+        content += (
+            f"--{boundary}\r\n"
+            f"Content-Type: application/http\r\n"
+            f"{headers}\r\n\r\n"
+            f"{status_line}\r\n"
+            f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+        ).encode() + body + b"\r\n"
+    return content + f"--{boundary}--\r\n".encode()
+
+
+class TestGmailBatch:
+    """Test the Gmail batch body helpers"""
+
+    def test_build_batch_body(self, gmail_agent):
+        """Each message becomes its own numbered messages.send part"""
+        body = gmail_agent.build_batch_body("b0", [b"AAAA", b"BBBB"])
+
+        assert body.count(b"--b0\r\n") == 2
+        assert body.endswith(b"--b0--\r\n")
+        assert b"Content-ID: <item0>" in body
+        assert b"Content-ID: <item1>" in body
+        assert body.count(b"POST /gmail/v1/users/me/messages/send") == 2
+        assert b'{"raw":"AAAA"}' in body
+        assert b'{"raw":"BBBB"}' in body
+
+    def test_parse_batch_response(self, gmail_agent):
+        """Parts are keyed by their item index, whatever order they arrive in"""
+        content = batch_response("resp", [
+            ("Content-ID: <response-item1>", "HTTP/1.1 400 Bad Request", b'{"error": "bad"}'),
+            ("Content-ID: <response-item0>", "HTTP/1.1 200 OK", b'{"id": "abc"}'),
+        ])
+
+        parts = gmail_agent.parse_batch_response('multipart/mixed; boundary="resp"', content)
+
+        assert parts == {0: (200, b'{"id": "abc"}'), 1: (400, b'{"error": "bad"}')}
+
+    def test_parse_batch_response_missing_content_id(self, gmail_agent):
+        """Parts without a Content-ID are skipped instead of guessed at"""
+        content = batch_response("resp", [
+            ("X-Other: 1", "HTTP/1.1 200 OK", b'{"id": "lost"}'),
+            ("Content-ID: <response-item1>", "HTTP/1.1 200 OK", b'{"id": "def"}'),
+        ])
+
+        parts = gmail_agent.parse_batch_response("multipart/mixed; boundary=resp", content)
+
+        assert parts == {1: (200, b'{"id": "def"}')}
+
+    def test_parse_batch_response_missing_boundary(self, gmail_agent):
+        """A content type without a boundary is an error, not an IndexError"""
+        with pytest.raises(Exception, match="no multipart boundary"):
+            gmail_agent.parse_batch_response("multipart/mixed", b"")
+        with pytest.raises(Exception, match="no multipart boundary"):
+            gmail_agent.parse_batch_response("", b"")